@@ -25,14 +25,14 @@ size = 1000  # in meters
 step_size = size/(N-2)
 outlet_rc = np.zeros(2, dtype=int)
 outlet_rc[0] = N - 2
-outlet_rc[1] = (N - 2)/2
+outlet_rc[1] = (N - 2) // 2
 
 
 # Heights
 coord, z = create_grid_set_heights(N, step_size, outlet_rc * step_size)
 heights = np.reshape(z, [N, N])
 plot.plot_heights(heights)
-print heights
+print(heights)
 ws_of_node, traps, trap_heights, trap_indices_in_ws, steepest_spill_pairs, flow_directions, heights = river_analysis.\
     calculate_watershed_of_node_no_landscape_input(heights, N, N, step_size, outlet_rc, d4=False)
 
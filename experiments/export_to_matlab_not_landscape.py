@@ -48,8 +48,8 @@ heights_trap_t = np.array([[3, 3, 3, 3, 3, 3, 3],
 outlet = (4, 1)
 step_size = 10
 ny, nx = np.shape(heights_three_traps_div)
-print 'ny', ny
-print 'nx', nx
+print('ny', ny)
+print('nx', nx)
 
 ws_of_node, traps, trap_heights, trap_indices_in_ws, steepest_spill_pairs, flow_directions, heights = river_analysis.\
     calculate_watershed_of_node_no_landscape_input(heights_three_traps_div, nx, ny, step_size, outlet, d4=False)
@@ -1,6 +1,6 @@
 from lib import river_analysis
 import scipy.io
-import cPickle as pickle
+import pickle
 
 """
 Export a watershed given an outlet
@@ -21,7 +21,7 @@ heights = np.array([[4, 10, 10, 10, 10, 10, 10],
                     [10, 10, 10, 10, 10, 10, 10]])
 
 util.make_depressionless(heights, 10, False)
-print heights
+print(heights)
 #a, b, c = util.calculate_watersheds(heights, 7, 7, 10, False)
 #print a
 #print b
@@ -1,6 +1,6 @@
 
 from lib import load_data, plot, util, river_analysis
-import cPickle as pickle
+import pickle
 import numpy as np
 
 """
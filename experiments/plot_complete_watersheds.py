@@ -1,6 +1,6 @@
 from lib import load_data, plot, util
 import numpy as np
-import cPickle as pickle
+import pickle
 
 """
 Plot the landscape in two dimensions
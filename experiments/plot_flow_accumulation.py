@@ -1,5 +1,5 @@
 from lib import plot
-import cPickle as pickle
+import pickle
 
 """
 Plot accumulated flow, either by loading it, or calculating it and saving
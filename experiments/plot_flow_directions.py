@@ -1,6 +1,6 @@
 from lib import plot, util
 import seaborn as sns; sns.set()
-import cPickle as pickle
+import pickle
 
 """
 Plot the flow directions
@@ -4,7 +4,7 @@ import time
 from scipy.sparse import csr_matrix, find
 import numpy as np
 from scipy import sparse, io
-import cPickle as pickle
+import pickle
 
 """
 Plot the landscape in two dimensions
@@ -15,6 +15,6 @@ landscape = pickle.load(open(saved_files + 'landscape.pkl', 'rb'))
 
 flow_dir = util.get_flow_directions(landscape.heights, landscape.step_size, landscape.ny, landscape.nx)
 minima = (flow_dir == -1).astype(int)
-print minima
+print(minima)
 
 plot.plot_local_minima(minima, landscape)
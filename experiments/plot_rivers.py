@@ -1,6 +1,6 @@
 
 from lib import plot, river_analysis
-import cPickle as pickle
+import pickle
 import numpy as np
 
 """
@@ -18,8 +18,8 @@ spill_heights = pickle.load(open(saved_files + 'spillHeights.pkl', 'rb'))
 all_traps = pickle.load(open(saved_files + 'allTraps.pkl', 'rb'))
 size_of_traps = pickle.load(open(saved_files + 'sizeOfTraps.pkl', 'rb'))
 
-print len(thresholded_watersheds)
-print len(steepest_spill_pairs)
+print(len(thresholded_watersheds))
+print(len(steepest_spill_pairs))
 threshold = 500
 thresholded_traps = [all_traps[i] for i in range(len(all_traps)) if size_of_traps[i] > threshold]
 
@@ -1,5 +1,5 @@
 from lib import load_data, plot, util, river_analysis
-import cPickle as pickle
+import pickle
 import numpy as np
 import time
 
@@ -23,6 +23,6 @@ steepest_steepest_spill_pairs = util.remap_steepest_spill_pairs(
     watershedsThresholded, steepest_spill_pairs, landscape.ny, landscape.nx)
 
 threshold = 2500
-traps = util.get_threshold_traps(watersheds, size_of_traps, threshold, landscape.heights)
+traps = util.get_threshold_traps(watersheds, size_of_traps, threshold, landscape.heights, spill_heights)
 
 plot.plot_traps(watershedsThresholded, traps, threshold, landscape, 4)
@@ -1,6 +1,6 @@
 
 from lib import plot, river_analysis, util
-import cPickle as pickle
+import pickle
 import numpy as np
 
 """
@@ -36,7 +36,7 @@ selected_watersheds = [watersheds[i] for i in watershed_indices]
 
 # Get the watersheds the river flows through
 ws_river_passes_through = np.unique([mapping[el] for el in all_rivers])
-print ws_river_passes_through
+print(ws_river_passes_through)
 river_watersheds = [watersheds[i] for i in ws_river_passes_through]
 
 # Traps of watersheds the river passes through
@@ -1,7 +1,7 @@
 from lib import load_data, plot, util, river_analysis
 import time
 import numpy as np
-import cPickle as pickle
+import pickle
 
 """
 Plot the upslope/downslope watersheds, or both
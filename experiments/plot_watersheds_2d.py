@@ -1,5 +1,5 @@
 from lib import plot, util
-import cPickle as pickle
+import pickle
 
 """
 Plot the watersheds, either thresholded or not
@@ -1,6 +1,6 @@
 from lib import load_data, plot, util
 import numpy as np
-import cPickle as pickle
+import pickle
 
 """
 
@@ -14,19 +14,19 @@ landscape = load_data.get_landscape_tyrifjorden(file_name)
 watersheds = pickle.load(open(saved_files + 'watersheds.pkl', 'rb'))
 # steepest_spill_pairs = pickle.load(open(saved_files + 'steepestSpillPairs.pkl', 'rb'))
 # combined_minima = pickle.load(open(saved_files + 'combinedMinima.pkl', 'rb'))
-print len(watersheds)
+print(len(watersheds))
 # # Fill single cell depressions
 landscape.heights = util.fill_single_cell_depressions(landscape.heights, landscape.ny, landscape.nx)
 
 # Get flow directions and initial watersheds
 flow_directions = util.get_flow_direction_indices(landscape.heights, landscape.step_size, landscape.ny, landscape.nx)
-print len(np.where(flow_directions == -1)[0])
+print(len(np.where(flow_directions == -1)[0]))
 node_endpoints = util.get_node_endpoints(flow_directions)
 local_watersheds = util.get_local_watersheds(node_endpoints)
-local_minima = np.asarray(local_watersheds.keys())
-print len(local_minima)
+local_minima = np.fromiter(local_watersheds.keys(), dtype=int, count=len(local_watersheds))
+print(len(local_minima))
 combined_minima = util.combine_minima(local_minima, landscape.ny, landscape.nx)
-print len(combined_minima)
+print(len(combined_minima))
 #print combined_minima
 # pickle.dump(combined_minima, open('combinedMinima.pkl', 'wb'))
 # watersheds = util.combine_watersheds(local_watersheds, combined_minima)
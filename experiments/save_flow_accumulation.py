@@ -1,5 +1,5 @@
 from lib import util, river_analysis, load_data, plot
-import cPickle as pickle
+import pickle
 
 """
 Calculates the accumulated flow for each node in the landscape. A node's number is the number of upslope nodes it has.
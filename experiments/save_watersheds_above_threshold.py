@@ -1,6 +1,6 @@
 
 from lib import load_data, plot, util, river_analysis
-import cPickle as pickle
+import pickle
 import numpy as np
 import time
 
@@ -39,8 +39,8 @@ start = time.time()
 conn_mat_after_thresholding, watersheds_after_thresholding = util.remove_watersheds_below_threshold(
     watersheds, conn_mat, size_of_traps, threshold, landscape.heights, landscape.total_nodes)
 end = time.time()
-print end-start
+print(end-start)
 
 # Save the new connMat and watersheds
-pickle.dump(conn_mat_after_thresholding, open('connMatThreshold25.pkl', 'wb'))
-pickle.dump(watersheds_after_thresholding, open('watershedsThreshold25.pkl', 'wb'))
+pickle.dump(conn_mat_after_thresholding, open('connMatThreshold25.pkl', 'wb'), protocol=5)
+pickle.dump(watersheds_after_thresholding, open('watershedsThreshold25.pkl', 'wb'), protocol=5)
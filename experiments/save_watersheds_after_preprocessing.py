@@ -1,6 +1,6 @@
 from lib import load_data, plot, util
 import numpy as np
-import cPickle as pickle
+import pickle
 import time
 
 
@@ -26,7 +26,7 @@ flow_directions = util.get_flow_direction_indices(landscape.heights, landscape.s
 
 node_endpoints = util.get_node_endpoints(flow_directions)
 local_watersheds = util.get_local_watersheds(node_endpoints)
-local_minima = np.asarray(local_watersheds.keys())
+local_minima = np.fromiter(local_watersheds.keys(), dtype=int, count=len(local_watersheds))
 combined_minima = util.combine_minima(local_minima, landscape.ny, landscape.nx)
 watersheds = util.combine_watersheds(local_watersheds, combined_minima)
 
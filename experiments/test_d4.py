@@ -31,18 +31,18 @@ step_size = 10
 flow_directions = util.get_flow_direction_indices(heights, step_size, dim_y, dim_x, d4=True)
 node_endpoints = util.get_node_endpoints(flow_directions)
 local_watersheds = util.get_local_watersheds(node_endpoints)
-local_minima = np.asarray(local_watersheds.keys())
+local_minima = np.fromiter(local_watersheds.keys(), dtype=int, count=len(local_watersheds))
 combined_minima = util.combine_minima(local_minima, dim_y, dim_x, d4=True)
 watersheds = util.combine_watersheds(local_watersheds, combined_minima)
-print 'flow_directions: ', flow_directions
-print 'node_endpoints: ', node_endpoints
-print 'local_watersheds: ', local_watersheds
-print 'local_minima: ', local_minima
-print 'combined_minima: ', combined_minima
-print 'watersheds: ', watersheds
+print('flow_directions: ', flow_directions)
+print('node_endpoints: ', node_endpoints)
+print('local_watersheds: ', local_watersheds)
+print('local_minima: ', local_minima)
+print('combined_minima: ', combined_minima)
+print('watersheds: ', watersheds)
 boundary_pairs = util.get_boundary_pairs_in_watersheds(watersheds, dim_x, dim_y, d4=True)
-print 'possible spill pairs: ', util.get_possible_spill_pairs(heights, boundary_pairs)
+print('possible spill pairs: ', util.get_possible_spill_pairs(heights, boundary_pairs))
 watersheds, steepest_spill_pairs = util.combine_watersheds_spilling_into_each_other(watersheds, heights, d4=True)
 
-print 'watersheds after combining: ', watersheds
-print 'steepest_spill_pairs: ', steepest_spill_pairs
+print('watersheds after combining: ', watersheds)
+print('steepest_spill_pairs: ', steepest_spill_pairs)
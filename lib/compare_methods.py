@@ -1,4 +1,5 @@
 import numpy as np
+import math
 
 
 def compare_two_dictionaries_where_values_are_arrays(d1, d2):
@@ -140,3 +141,40 @@ def compare_boundary_pairs(b1, b2):
         b2_set = set(zip(b2[i][0], b2[i][1]))
         if b1_set != b2_set:
             return False
+
+
+def compare_rivers_in_trap(r1, r2, trap, cols, d4):
+    """
+    Several rivers through a trap can be equally short. Returns True if both rivers have the same start and end,
+    only step between neighbors in the trap, and have the same length.
+    :param r1: River 1.
+    :param r2: River 2.
+    :param trap: The indices of the nodes in the trap.
+    :param cols: Nr of columns in the grid.
+    :param d4: Use the D4-method instead of D8.
+    :return: True if the rivers are equally good, False if not.
+    """
+
+    r1 = np.asarray(r1)
+    r2 = np.asarray(r2)
+
+    if r1[0] != r2[0] or r1[-1] != r2[-1]:  # Different start or end
+        return False
+
+    lengths = []
+    for river in [r1, r2]:
+        if not np.all(np.isin(river, trap)):
+            return False
+
+        river_rows, river_cols = np.divmod(river, cols)
+        dr = np.abs(np.diff(river_rows))
+        dc = np.abs(np.diff(river_cols))
+        is_cardinal = dr + dc == 1
+        is_diagonal = np.logical_and(dr == 1, dc == 1)
+        if d4:
+            is_diagonal[:] = False
+        if not np.all(np.logical_or(is_cardinal, is_diagonal)):  # Not only steps between neighbors
+            return False
+        lengths.append(10 * np.sum(is_cardinal) + math.sqrt(200) * np.sum(is_diagonal))
+
+    return math.isclose(lengths[0], lengths[1])
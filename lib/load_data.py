@@ -18,7 +18,7 @@ class Landscape:
         step_size_y = geo_transform[5]
         unequal_step_size = (abs(step_size_x) != abs(step_size_y))
         if unequal_step_size:
-            print 'The step size in the x- and y-direction is not equal'
+            print('The step size in the x- and y-direction is not equal')
             return
         self.step_size = step_size_x
 
@@ -33,7 +33,7 @@ def load_ds(filename):
     ds = gdal.Open(filename)
 
     if ds is None:
-        print "Error retrieving data set."
+        print("Error retrieving data set.")
         return
 
     return ds
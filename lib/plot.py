@@ -82,13 +82,13 @@ def plot_watersheds_2d(watersheds, outlet, landscape, ds):
     if len(watersheds) < 3:
         color_small = iter(color_hex)
     else:
-        color_small = iter(color_hex * (len(watersheds)/3))
+        color_small = iter(color_hex * (len(watersheds) // 3))
     fig = plt.figure()
     ax = fig.gca()  # fig.add_subplot(111, aspect=1)
 
     # Plot the watersheds
     for i in range(nr_of_watersheds):
-        print i
+        print(i)
         row_col = util.map_1d_to_2d(watersheds[i], landscape.nx)
         plt.scatter(landscape.x_min + row_col[1][0::ds],
                     landscape.y_max - row_col[0][0::ds],
@@ -128,7 +128,7 @@ def plot_watersheds_2d_coords(watersheds, landscape, ds):
     if len(watersheds) < 3:
         color_small = iter(color_hex)
     else:
-        color_small = iter(color_hex * (len(watersheds)/3))
+        color_small = iter(color_hex * (len(watersheds) // 3))
     fig = plt.figure()
     ax = fig.add_subplot(111, aspect=1)
 
@@ -159,7 +159,7 @@ def plot_traps_and_river_in_one_watershed_2d(selected_traps, river_watersheds, s
     boundary_pairs = util.get_boundary_pairs_in_watersheds(selected_watersheds, landscape.nx, landscape.ny)
 
     color_hex = ['#d9d9d9', '#bdbdbd', '#969696', '#737373', '#525252', '#252525']
-    color_ws = iter(color_hex * (len(selected_watersheds) / 3))
+    color_ws = iter(color_hex * (len(selected_watersheds) // 3))
 
     fig = plt.figure()
     ax = fig.add_subplot(111, aspect=1)
@@ -219,7 +219,7 @@ def plot_watersheds_before_thresholding(watersheds, landscape, ds):
     large_watersheds.sort(key=len)
 
     color_small = ['red', 'green', 'blue', 'yellow']
-    colors = iter(color_small * (len(watersheds)/3))
+    colors = iter(color_small * (len(watersheds) // 3))
 
     fig = plt.figure()
     ax = fig.add_subplot(111, aspect=1)
@@ -304,7 +304,7 @@ def plot_up_and_downslope_watersheds(watersheds, upslope_indices, downslope_indi
     boundary_pairs = util.get_boundary_pairs_in_watersheds(watersheds, landscape.nx, landscape.ny)
 
     color_hex = ['#d9d9d9', '#bdbdbd', '#969696', '#737373', '#525252', '#252525']
-    colors = iter(color_hex * (nr_of_watersheds/3))
+    colors = iter(color_hex * (nr_of_watersheds // 3))
     upslope_colors = iter(cm.Blues_r(np.linspace(0, 1, len(node_levels))))
     not_upslope = np.setdiff1d(np.arange(0, len(watersheds), 1), upslope_indices)
 
@@ -414,7 +414,7 @@ def plot_traps_and_rivers(watersheds, traps, rivers, landscape, ds=1):
     nr_of_watersheds = len(watersheds)
 
     color_hex = ['#d9d9d9', '#bdbdbd', '#969696', '#737373', '#525252', '#252525']
-    color_small = iter(color_hex * (len(watersheds) / 3))
+    color_small = iter(color_hex * (len(watersheds) // 3))
 
     fig = plt.figure()
     ax = fig.add_subplot(111, aspect=1)
@@ -466,10 +466,10 @@ def plot_watersheds_and_minima_2d(watersheds, minima, landscape, ds):
     large_watersheds.sort(key=len)
     nr_of_large_watersheds = len(large_watersheds)
 
-    print 'nr of large watersheds: ', nr_of_large_watersheds
+    print('nr of large watersheds: ', nr_of_large_watersheds)
 
     color_small = ['red', 'green', 'blue', 'yellow']
-    color_small = iter(color_small * (len(watersheds)/3))
+    color_small = iter(color_small * (len(watersheds) // 3))
 
     nr_of_largest = 5
 
@@ -480,7 +480,7 @@ def plot_watersheds_and_minima_2d(watersheds, minima, landscape, ds):
                     color=next(color_small), s=20, lw=0, alpha=1)
 
     color_large = ['gold', 'darkgreen', 'darkorange', 'darkorchid', 'dodgerblue']
-    color_large = iter(color_large * (len(watersheds)/3))
+    color_large = iter(color_large * (len(watersheds) // 3))
 
     for i in range(nr_of_large_watersheds - nr_of_largest, nr_of_large_watersheds):
         row_col = util.map_1d_to_2d(large_watersheds[i], landscape.nx)
@@ -506,7 +506,7 @@ def plot_traps(watersheds, traps, threshold, landscape, ds):
     nr_of_watersheds = len(watersheds)
 
     color_hex = ['#d9d9d9', '#bdbdbd', '#969696', '#737373', '#525252', '#252525']
-    color_small = iter(color_hex * (len(watersheds) / 3))
+    color_small = iter(color_hex * (len(watersheds) // 3))
 
     # Plot the watersheds
     for i in range(nr_of_watersheds):
@@ -650,7 +650,7 @@ def plot_difference_d4_and_d8(watersheds, outlet, landscape, ds):
     if len(watersheds) < 3:
         color_small = iter(color_hex)
     else:
-        color_small = iter(color_hex * (len(watersheds)/3))
+        color_small = iter(color_hex * (len(watersheds) // 3))
     fig = plt.figure()
     ax = fig.gca()  # fig.add_subplot(111, aspect=1)
 
@@ -1,8 +1,9 @@
 from lib import util, plot
 import networkx as nx
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, csgraph
 import numpy as np
 from math import sqrt
+from numba import njit
 
 
 def get_upslope_watersheds(conn_mat, ws_nr):
@@ -13,40 +14,23 @@ def get_upslope_watersheds(conn_mat, ws_nr):
     :return upslope_watersheds: Indices of all upslope watersheds
     """
 
-    initial_upslope = conn_mat[:, ws_nr].nonzero()[0]
+    # Breadth first search on the transposed matrix follows the connections upslope
+    upslope_conn_mat = conn_mat.T.tocsr()
+    upslope_watersheds = csgraph.breadth_first_order(upslope_conn_mat, ws_nr, directed=True,
+                                                     return_predecessors=False)
 
-    not_visited_ws = initial_upslope.tolist()
-    visited_ws = [ws_nr]
+    if len(upslope_watersheds) == 1:  # There are no upslope neighbors
+        return upslope_watersheds.tolist(), None
 
-    if len(initial_upslope) == 0:  # There are no upslope neighbors
-        return visited_ws, None
+    # To be able to give a sense of distance away from watershed, count the steps to each upslope watershed
+    depth = csgraph.shortest_path(upslope_conn_mat, directed=True, unweighted=True, indices=ws_nr)
+    depth = depth[upslope_watersheds].astype(int)
 
-    visited_ws.extend(initial_upslope)
+    # The nodes come in breadth first order, so the levels are already sorted
+    level_sizes = np.bincount(depth)
+    node_levels = [level.tolist() for level in np.split(upslope_watersheds, np.cumsum(level_sizes)[:-1])]
 
-    # To be able to give a sense of distance away from watershed
-    node_levels = [[ws_nr], list(not_visited_ws)]
-    level = 1
-
-    while not_visited_ws:  # As long as new upslope ws are found
-        ix = not_visited_ws.pop(0)  # Use it as a queue to keep levels
-        new_upslope_ws = conn_mat[:, ix].nonzero()[0]
-
-        if ix not in node_levels[level]:
-            level += 1
-            node_levels.append(new_upslope_ws.tolist())
-        else:
-            next_level_nr = level + 1  # You fill up next level before switching
-            if len(node_levels) > next_level_nr:
-                node_levels[next_level_nr].extend(new_upslope_ws.tolist())
-            else:
-                node_levels.append(new_upslope_ws.tolist())
-
-        not_visited_ws.extend(new_upslope_ws)
-        visited_ws.extend(new_upslope_ws)
-
-    upslope_watersheds = visited_ws
-
-    return upslope_watersheds, node_levels
+    return upslope_watersheds.tolist(), node_levels
 
 
 def get_downslope_watersheds(conn_mat, ws_nr):
@@ -57,26 +41,10 @@ def get_downslope_watersheds(conn_mat, ws_nr):
     :return downslope_watersheds: Indices of all downslope watersheds
     """
 
-    initial_downslope = conn_mat[ws_nr, :].nonzero()[1]
-
-    not_visited_ws = [initial_downslope]
-    visited_ws = [ws_nr]
+    downslope_watersheds = csgraph.breadth_first_order(conn_mat.tocsr(), ws_nr, directed=True,
+                                                       return_predecessors=False)
 
-    if len(initial_downslope) == 0:  # There are no downslope neighbors
-        return visited_ws
-
-    visited_ws.extend(initial_downslope)
-
-    while not_visited_ws:  # As long as new downslope ws are found
-        ix = not_visited_ws.pop()
-        new_downslope_ws = conn_mat[ix, :].nonzero()[1]
-
-        not_visited_ws.extend(new_downslope_ws)
-        visited_ws.extend(new_downslope_ws)
-
-    downslope_watersheds = visited_ws
-
-    return downslope_watersheds
+    return downslope_watersheds.tolist()
 
 
 def get_all_rivers_before_thresholding(watersheds, heights, steepest_spill_pairs, spill_heights, flow_direction_indices):
@@ -92,27 +60,25 @@ def get_all_rivers_before_thresholding(watersheds, heights, steepest_spill_pairs
 
     r, c = np.shape(heights)
     mapping = util.map_nodes_to_watersheds(watersheds, r, c)
+    flat_heights = np.ravel(heights)
+    flat_flow_direction_indices = np.ravel(flow_direction_indices)
 
-    spill_to = np.asarray([el[1] for el in steepest_spill_pairs])
-    order = np.argsort([mapping[s] for s in spill_to])
+    spill_from, spill_to = util.split_spill_pairs(steepest_spill_pairs)
+    order = np.argsort(mapping[spill_to])
     rivers = []
     # Remove all spill points at the edge
-    it = 0
     for start in order:
-        it += 1
-        print it
         start = spill_to[start]
         # Find which watershed the river is in
         ws_nr = mapping[start]
         if ws_nr > -1:
             ws = watersheds[ws_nr]
-            traps_in_ws = ws[np.where(heights[util.map_1d_to_2d(ws, c)] <= spill_heights[ws_nr])[0]]
+            traps_in_ws = ws[np.where(flat_heights[ws] <= spill_heights[ws_nr])[0]]
             river = [start]
-            ix = util.map_1d_to_2d(start, c)
-            next_node = flow_direction_indices[util.map_1d_to_2d(start, c)]
+            next_node = flat_flow_direction_indices[start]
             while next_node:
                 river.append(next_node)
-                next_node = flow_direction_indices[util.map_1d_to_2d(next_node, c)]
+                next_node = flat_flow_direction_indices[next_node]
                 if next_node in traps_in_ws or next_node == -1:  # If the next node is in the trap we're at the end of the river
                     next_node = False
             rivers.append(river)
@@ -120,7 +86,7 @@ def get_all_rivers_before_thresholding(watersheds, heights, steepest_spill_pairs
     return np.concatenate(rivers)
 
 
-def get_rivers(watersheds, new_watersheds, steepest_spill_pairs, traps, downslope_indices, heights):
+def get_rivers(watersheds, new_watersheds, steepest_spill_pairs, traps, downslope_indices, heights, d4=False):
     """
     Returns all rivers between traps and from traps and to the boundary
     :param watersheds: The nodes in the different watersheds
@@ -129,6 +95,7 @@ def get_rivers(watersheds, new_watersheds, steepest_spill_pairs, traps, downslop
     :param traps: The trap in every watershed
     :param downslope_indices: The downslope node for all nodes
     :param heights: Elevations in the landscape
+    :param d4: Use the D4-method instead of D8
     :return all_rivers: The rivers between the traps and from traps to the boundary
     """
 
@@ -140,40 +107,60 @@ def get_rivers(watersheds, new_watersheds, steepest_spill_pairs, traps, downslop
     mapping = util.map_nodes_to_watersheds(watersheds, rows, cols)
     merged_watersheds = [np.unique(mapping[ws]) for ws in new_watersheds]
     all_rivers = []
+    trap_graphs = {}  # Several rivers can cross the same trap, so only build its graph once
+    spill_from, spill_to = util.split_spill_pairs(steepest_spill_pairs)
+    spill_from_ws = mapping[spill_from]
+    spill_to_ws = mapping[spill_to]
+
+    # The thresholded watershed each watershed is part of. The extra last element is -1 for watershed nr -1.
+    thresholded_nr = -np.ones(len(watersheds) + 1, dtype=int)
+    for i in range(len(merged_watersheds)):
+        thresholded_nr[merged_watersheds[i]] = i
+    spill_from_thresholded = thresholded_nr[spill_from_ws]
+    spill_to_thresholded = thresholded_nr[spill_to_ws]
+
+    # The rivers are followed on flat views, and the trap each node is in is looked up instead of searched for
+    flat_downslope_indices = np.ravel(downslope_indices)
+    trap_of_node = util.map_nodes_to_watersheds(traps, rows, cols)
 
     for i in range(len(merged_watersheds)):  # Iterate over the thresholded watersheds
         # A new river for the watershed
-        small_watersheds = merged_watersheds[i]
-        spill_pairs_merged_watersheds = [(mapping[s[0]], mapping[s[1]]) for s in steepest_spill_pairs
-                                         if mapping[s[0]] in small_watersheds or mapping[s[1]] in small_watersheds]
+        is_in_merged = (spill_from_thresholded == i) | (spill_to_thresholded == i)
+        spill_pairs_merged_watersheds = list(zip(spill_from_ws[is_in_merged], spill_to_ws[is_in_merged]))
 
-        # River must go from start to end
-        start = [el for el in spill_pairs_merged_watersheds if el[0] not in small_watersheds]
+        # River must go from start to end. The start pairs come from outside the thresholded watershed, and the end
+        # pair goes out of it
+        is_start = is_in_merged & (spill_from_thresholded != i)
+        start = list(zip(spill_from_ws[is_start], spill_to_ws[is_start]))
         # Note: There is always a maximum of one end watershed
-        end = [el for el in spill_pairs_merged_watersheds if el[1] not in small_watersheds][0]
+        is_end = is_in_merged & (spill_to_thresholded != i)
+        end = list(zip(spill_from_ws[is_end], spill_to_ws[is_end]))[0]
+
+        G = nx.Graph()
+        G.add_edges_from(spill_pairs_merged_watersheds)
 
         for r in range(len(start)):  # A trap might have several rivers flowing to it
             large_river = []
-            G = nx.Graph()
-            G.add_edges_from(spill_pairs_merged_watersheds)
             river_ws = nx.shortest_path(G, start[r][0], end[0])
 
             for j in range(len(river_ws) - 1):  # The watersheds that are part of the river
-                spill_start = steepest_spill_pairs[river_ws[j]][1]
-                spill_end = steepest_spill_pairs[river_ws[j+1]][0]
+                spill_start = spill_to[river_ws[j]]
+                spill_end = spill_from[river_ws[j+1]]
                 trap_in_ws = traps[river_ws[j+1]]
+                if river_ws[j+1] not in trap_graphs:
+                    trap_graphs[river_ws[j+1]] = get_trap_graph(trap_in_ws, cols, d4)
                 river = []
                 new_river_node = spill_start
                 while new_river_node:
                     river.append(new_river_node)
-                    if new_river_node in trap_in_ws:
+                    if trap_of_node[new_river_node] == river_ws[j+1]:
                         if j != len(river_ws) - 2:
-                            river_through_trap = get_river_in_trap(trap_in_ws, new_river_node,
-                                                                   spill_end, cols)
+                            river_through_trap = get_river_in_trap(trap_in_ws, new_river_node, spill_end, cols, d4,
+                                                                   trap_graphs[river_ws[j+1]])
                             river.extend(river_through_trap)
                         new_river_node = False
                     else:
-                        new_river_node = downslope_indices[util.map_1d_to_2d(new_river_node, cols)]
+                        new_river_node = flat_downslope_indices[new_river_node]
                 large_river.extend(river[:-1])  # Remove the last node in the river as it will be in the trap/lake
 
             all_rivers.append(large_river)
@@ -181,7 +168,7 @@ def get_rivers(watersheds, new_watersheds, steepest_spill_pairs, traps, downslop
     return all_rivers
 
 
-def get_river_in_trap(trap, start, end, cols, d4):
+def get_river_in_trap(trap, start, end, cols, d4, trap_graph=None):
     """
     Returns the river through a trap as an array
     :param trap: The indices of the nodes in the trap
@@ -189,20 +176,47 @@ def get_river_in_trap(trap, start, end, cols, d4):
     :param end: End point of the river
     :param cols: Number of cols in the data set
     :param d4: Use the D4-method instead of D8
+    :param trap_graph: The graph of the trap from get_trap_graph, it is built if not given
     :return river: The river through the trap
     """
 
+    if trap_graph is None:
+        trap_graph = get_trap_graph(trap, cols, d4)
+    indptr, local_nbrs, weights, offset, position = trap_graph
+
+    path = _shortest_path(indptr, local_nbrs, weights, position[start - offset], position[end - offset])
+
+    river = trap[path]
+
+    return river
+
+
+def get_trap_graph(trap, cols, d4):
+    """
+    Returns the graph of neighboring nodes in a trap in csr form. The nodes are numbered by their position in the trap.
+    :param trap: The indices of the nodes in the trap
+    :param cols: Number of cols in the data set
+    :param d4: Use the D4-method instead of D8
+    :return indptr: Index pointer of the graph
+    :return local_nbrs: The neighbor of each edge
+    :return weights: The distance of each edge
+    :return offset: The first index covered by position
+    :return position: The position in the trap of node offset + i, -1 if it is not in the trap
+    """
+
     # Get the neighbors of the trap nodes
     nbrs_of_trap_indices = util.get_neighbor_indices(trap, cols, d4)
     nbrs = np.hstack(nbrs_of_trap_indices)
-    if d4:
-        repeat_trap = np.repeat(trap, 4)
-    else:
-        repeat_trap = np.repeat(trap, 8)
+
+    # Look up trap membership in an array covering only the rows the trap and its neighbors are in
+    offset = np.min(trap) - cols - 1
+    position = -np.ones(np.max(trap) + cols + 2 - offset, dtype=int)
+    position[trap - offset] = np.arange(len(trap))
+
     # Find the pairs of all nodes in the trap that are neighbors
-    are_pairs = np.in1d(nbrs_of_trap_indices, trap)
-    trap_indices = repeat_trap[are_pairs]
-    trap_nbrs = nbrs[are_pairs]
+    local_nbrs = position[nbrs - offset]
+    are_pairs = local_nbrs != -1
+    local_nbrs = local_nbrs[are_pairs]
 
     # Find the weights of each pair
     if d4:
@@ -212,14 +226,99 @@ def get_river_in_trap(trap, start, end, cols, d4):
     repeat_distance = np.tile(distance, len(trap))
     weights = repeat_distance[are_pairs]
 
-    # Create the graph and add pairs and weights
-    pairs = zip(trap_indices, trap_nbrs, weights)
-    T = nx.Graph()
-    T.add_weighted_edges_from(pairs)
+    # The pairs are already sorted by their first node
+    indptr = np.concatenate(([0], np.cumsum(are_pairs.reshape(len(trap), -1).sum(axis=1))))
 
-    river = nx.shortest_path(T, start, end, weight='weight')
+    return indptr, local_nbrs, weights, offset, position
 
-    return river
+
+@njit(cache=True)
+def _shortest_path(indptr, indices, weights, source, target):
+    """
+    Dijkstra's algorithm using a binary heap stored in arrays
+    :param indptr: Index pointer of the csr graph
+    :param indices: Neighbor of each edge in the csr graph
+    :param weights: Weight of each edge in the csr graph
+    :param source: Start node of the path
+    :param target: End node of the path
+    :return path: The nodes of the shortest path from source to target
+    """
+
+    n = len(indptr) - 1
+    dist = np.full(n, np.inf)
+    predecessors = np.full(n, -1, dtype=np.int64)
+    done = np.zeros(n, dtype=np.bool_)
+
+    # Every edge relaxation pushes at most one entry, so the heap never grows beyond this
+    heap_dist = np.empty(len(indices) + 1)
+    heap_node = np.empty(len(indices) + 1, dtype=np.int64)
+    heap_dist[0] = 0.0
+    heap_node[0] = source
+    size = 1
+    dist[source] = 0.0
+
+    while size > 0:
+        u = heap_node[0]
+        size -= 1
+        # Move the last entry to the root and sift it down
+        d_last = heap_dist[size]
+        u_last = heap_node[size]
+        i = 0
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap_dist[child + 1] < heap_dist[child]:
+                child += 1
+            if heap_dist[child] >= d_last:
+                break
+            heap_dist[i] = heap_dist[child]
+            heap_node[i] = heap_node[child]
+            i = child
+        heap_dist[i] = d_last
+        heap_node[i] = u_last
+
+        if done[u]:  # Stale heap entry
+            continue
+        done[u] = True
+        if u == target:
+            break
+
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            new_dist = dist[u] + weights[k]
+            if new_dist < dist[v]:
+                dist[v] = new_dist
+                predecessors[v] = u
+                # Push and sift up
+                i = size
+                size += 1
+                while i > 0:
+                    parent = (i - 1) // 2
+                    if heap_dist[parent] <= new_dist:
+                        break
+                    heap_dist[i] = heap_dist[parent]
+                    heap_node[i] = heap_node[parent]
+                    i = parent
+                heap_dist[i] = new_dist
+                heap_node[i] = v
+
+    if not done[target]:
+        raise ValueError('There is no path from source to target')
+
+    length = 1
+    node = target
+    while node != source:
+        node = predecessors[node]
+        length += 1
+
+    path = np.empty(length, dtype=np.int64)
+    node = target
+    for i in range(length - 1, -1, -1):
+        path[i] = node
+        node = predecessors[node]
+
+    return path
 
 
 def calculate_nr_of_upslope_cells(node_conn_mat, rows, cols, traps, steepest_spill_pairs, d4):
@@ -236,53 +335,20 @@ def calculate_nr_of_upslope_cells(node_conn_mat, rows, cols, traps, steepest_spi
     """
 
     # Retrieve the expanded connectivity matrix with traps as nodes
-    node_conn_mat = expand_conn_mat(node_conn_mat, len(traps))
     conn_mat = reroute_trap_connections(node_conn_mat, rows, cols, traps, steepest_spill_pairs, d4)
 
     # The flow starts in the start_cells. These are the cells without flow leading in to them
     start_nodes = calculate_flow_origins(conn_mat, traps, rows, cols)
     flow_acc, one_or_trap_size = assign_initial_flow_acc(traps, start_nodes, rows, cols)
-    _, next_nodes = conn_mat[start_nodes, :].nonzero()
-    next_nodes = np.unique(next_nodes)
-
-    current_nodes = next_nodes
-    it = 0
-
-    while len(current_nodes) > 0:
-        print 'Iteration: ', it
-        # Current nodes cannot be assigned flow without previous nodes having flow assigned
-        previous_nodes, corr_current_index = conn_mat[:, current_nodes].nonzero()
-        _, flow_to_each_current = np.unique(corr_current_index, return_counts=True)
-        previous_nodes_with_flow = flow_acc[previous_nodes] > 0
-        remove_indices = corr_current_index[previous_nodes_with_flow == False]
-        keep_indices = np.setdiff1d(np.arange(0, len(current_nodes), 1), remove_indices)
-        sorting_order = np.argsort(corr_current_index)
-        previous_nodes = previous_nodes[sorting_order]
-        assign_flow_indices = np.setdiff1d(current_nodes, current_nodes[remove_indices])
-
-        # Calculate flow to current nodes having previous nodes with assigned flow
-        splits = np.cumsum(flow_to_each_current)
-        nodes_to_each_current = np.split(previous_nodes, splits)[:-1]
-        flow_to_each_current = np.asarray([np.sum(flow_acc[el]) for el in nodes_to_each_current])
-        flow_acc[current_nodes[keep_indices]] = flow_to_each_current[keep_indices]
-
-        # Add one or the trap size
-        flow_acc[assign_flow_indices] += one_or_trap_size[assign_flow_indices]
-
-        it += 1
-        if len(assign_flow_indices) > 0:
-            _, next_nodes = conn_mat[assign_flow_indices, :].nonzero()
-            next_nodes = np.unique(next_nodes)
-            unassigned_current_nodes = current_nodes[remove_indices]
-            current_nodes = np.union1d(next_nodes, unassigned_current_nodes)
-
-        else:
-            current_nodes = []
+
+    # Accumulate the flow in topological order, a node is done when all its upslope nodes are done
+    conn_mat.eliminate_zeros()
+    in_degree = np.bincount(conn_mat.indices, minlength=conn_mat.shape[0]).astype(np.int32)
+    _accumulate_flow(conn_mat.indptr, conn_mat.indices, in_degree, start_nodes, flow_acc, one_or_trap_size)
 
     # Map from trap nodes back to traps
-    for i in range(len(traps)):
-        trap = traps[i]
-        flow_acc[trap] = flow_acc[rows * cols + i]
+    trap_sizes = np.asarray([len(t) for t in traps])
+    flow_acc[np.concatenate(traps)] = np.repeat(flow_acc[rows * cols:], trap_sizes)
 
     flow_acc = flow_acc[:rows * cols]
     flow_acc = flow_acc.reshape(rows, cols)
@@ -290,26 +356,44 @@ def calculate_nr_of_upslope_cells(node_conn_mat, rows, cols, traps, steepest_spi
     return flow_acc
 
 
-def expand_conn_mat(conn_mat, nr_of_traps):
+@njit(cache=True)
+def _accumulate_flow(indptr, indices, in_degree, start_nodes, flow_acc, one_or_trap_size):
     """
-    Adds zero columns and rows to represent the trap nodes to the connectivity matrix
-    :param conn_mat: Connections between the nodes
-    :param nr_of_traps: Nr of trap nodes
-    :return expanded_mat: Expanded matrix to account for trap nodes
+    Kahn-style accumulation of flow along the connectivity matrix, in topological order
+    :param indptr: Index pointer of the csr connectivity matrix
+    :param indices: Column indices of the csr connectivity matrix
+    :param in_degree: Nr of upslope connections for each node
+    :param start_nodes: The flow start nodes, these already have their initial flow assigned
+    :param flow_acc: Accumulated flow for each node
+    :param one_or_trap_size: The flow each node contributes by itself
+    :return: Void function that alters flow_acc
     """
 
-    r, c = conn_mat._shape
-    new_indptr = np.hstack((conn_mat.indptr, np.asarray([conn_mat.indptr[-1]] * nr_of_traps)))
-    expanded_mat = csr_matrix((conn_mat.data, conn_mat.indices, new_indptr),
-                              shape=(r + nr_of_traps, c + nr_of_traps))
-
-    return expanded_mat
+    queue = np.empty(len(flow_acc), dtype=np.int64)
+    head = 0
+    tail = 0
+    for u in start_nodes:
+        queue[tail] = u
+        tail += 1
+
+    while head < tail:
+        u = queue[head]
+        head += 1
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            flow_acc[v] += flow_acc[u]
+            in_degree[v] -= 1
+            if in_degree[v] == 0:  # All upslope nodes have been assigned flow
+                flow_acc[v] += one_or_trap_size[v]
+                queue[tail] = v
+                tail += 1
 
 
 def reroute_trap_connections(conn_mat, rows, cols, traps, steepest_spill_pairs, d4):
     """
     Reroute connections going from nodes to traps so that they go to trap nodes instead. Remove the old connection.
-    :param conn_mat: Connectivity matrix between all nodes
+    The returned matrix is expanded with one row and column for each trap node.
+    :param conn_mat: Connectivity matrix between all nodes, with or without the trap nodes
     :param rows: Nr of rows in landscape
     :param cols: Nr of cols in landscape
     :param traps: All traps in landscape
@@ -319,38 +403,27 @@ def reroute_trap_connections(conn_mat, rows, cols, traps, steepest_spill_pairs,
     """
 
     # rows and cols is the original size (nx x ny)
-    r, c = np.shape(conn_mat)
-
-    # Add the connections: trap_nodes -> downslope_indices
-    trap_indices = np.arange(r - len(traps), r, 1)
-    downslope_indices = np.asarray([el[1] for el in steepest_spill_pairs])
-    add_conn_from_trap_nodes = csr_matrix((np.ones(len(trap_indices), dtype=int), (trap_indices, downslope_indices)), shape=(r, c))
-    conn_mat = conn_mat + add_conn_from_trap_nodes
+    r = c = rows * cols + len(traps)
 
-    # Add the connections: nodes_to_trap -> trap_nodes
+    # Where a connection to each node should go instead. Trap boundary nodes are replaced by their trap node,
+    # and connections to the domain boundary are removed.
+    new_to_node = np.arange(r)
     trap_boundaries = np.concatenate(get_traps_boundaries(traps, cols, rows, d4))
-    conn_node_to_trap = conn_mat[:, trap_boundaries].nonzero()
-    nodes_to_trap = conn_node_to_trap[0]
-    nodes_in_trap = trap_boundaries[conn_node_to_trap[1]]
     map_nodes_to_trap = util.map_nodes_to_watersheds(traps, rows, cols)
-    trap_nodes = map_nodes_to_trap[nodes_in_trap] + rows * cols
-
-    # Get nodes_to_trap's corresponding trap indices
-    add_conn_to_trap_nodes = csr_matrix(((np.ones(len(nodes_to_trap), dtype=int)), (nodes_to_trap, trap_nodes)), shape=(r, c))
-    conn_mat = conn_mat + add_conn_to_trap_nodes
+    new_to_node[trap_boundaries] = map_nodes_to_trap[trap_boundaries] + rows * cols
+    new_to_node[util.get_domain_boundary_indices(cols, rows)] = -1
 
-    # Remove the connections: nodes_to_trap -> nodes_in_trap
-
-    remove_conn_to_traps = csr_matrix((np.ones(len(nodes_to_trap), dtype=int) * -1, (nodes_to_trap, nodes_in_trap)), shape=(r, c))
-    conn_mat = conn_mat + remove_conn_to_traps
+    # Add the connections: trap_nodes -> downslope_indices
+    trap_indices = np.arange(r - len(traps), r, 1)
+    downslope_indices = util.split_spill_pairs(steepest_spill_pairs)[1]
 
-    # Remove flow out of boundary
-    domain_boundary = util.get_domain_boundary_indices(cols, rows)
-    conn_nodes_to_boundary = conn_mat[:, domain_boundary].nonzero()
-    nodes_to_boundary = conn_nodes_to_boundary[0]
-    boundary_nodes = domain_boundary[conn_nodes_to_boundary[1]]
-    remove_conn_to_boundary = csr_matrix(((np.ones(len(nodes_to_boundary), dtype=int) * -1), (nodes_to_boundary, boundary_nodes)), shape=(r, c))
-    conn_mat = conn_mat + remove_conn_to_boundary
+    # Reroute all connections in one pass, and build the matrix once
+    conn_mat = conn_mat.tocoo()
+    from_nodes = np.concatenate((conn_mat.row, trap_indices))
+    to_nodes = new_to_node[np.concatenate((conn_mat.col, downslope_indices))]
+    data = np.concatenate((conn_mat.data, np.ones(len(trap_indices), dtype=np.int32)))
+    keep = to_nodes != -1
+    conn_mat = csr_matrix((data[keep], (from_nodes[keep], to_nodes[keep])), shape=(r, c))
 
     return conn_mat
 
@@ -366,11 +439,11 @@ def calculate_flow_origins(expanded_conn_mat, traps, rows, cols):
     """
 
     # Remove boundary nodes and nodes with flow to them
-    boundary_indices = util.get_domain_boundary_indices(cols, rows)
-    nodes_with_upslope = expanded_conn_mat.nonzero()[1]
-    original_trap_nodes = np.concatenate(traps)
-    not_starting_nodes = np.unique(np.hstack((boundary_indices, nodes_with_upslope, original_trap_nodes)))
-    origin_nodes = np.setdiff1d(np.arange(rows * cols + len(traps)), not_starting_nodes).astype(int)
+    is_origin = np.ones(rows * cols + len(traps), dtype=bool)
+    is_origin[util.get_domain_boundary_indices(cols, rows)] = False
+    is_origin[expanded_conn_mat.nonzero()[1]] = False
+    is_origin[np.concatenate(traps)] = False
+    origin_nodes = np.flatnonzero(is_origin)
 
     return origin_nodes
 
@@ -382,7 +455,7 @@ def assign_initial_flow_acc(traps, start_nodes, rows, cols):
     :param start_nodes: The flow start nodes
     :param rows: Rows in landscape grid
     :param cols: Cols in landscape grid
-    :return acc_flow: Array for flow accumulation in the whole landscape. All nodes besides start nodes are None
+    :return acc_flow: Array for flow accumulation in the whole landscape. All nodes besides start nodes are 0
     """
 
     nr_of_nodes = int(rows * cols)
@@ -390,15 +463,16 @@ def assign_initial_flow_acc(traps, start_nodes, rows, cols):
     starting_trap_nodes = np.array(start_nodes[start_nodes >= nr_of_nodes])
 
     # Initialize accumulation flow array, and calculate the size of each trap
-    acc_flow = np.zeros(rows * cols + len(traps), dtype=int)
+    # 32-bit counts are enough for any landscape below 2^31 cells, and halve the memory traffic
+    acc_flow = np.zeros(rows * cols + len(traps), dtype=np.int32)
     trap_sizes = np.asarray([len(t) for t in traps])
 
-    one_or_trap_size = np.ones(len(acc_flow), dtype=int)
+    one_or_trap_size = np.ones(len(acc_flow), dtype=np.int32)
     one_or_trap_size[nr_of_nodes:] = trap_sizes
 
     # Assign flow to the starting trap nodes, and the other starting nodes
     acc_flow[starting_trap_nodes] = trap_sizes[starting_trap_nodes - nr_of_nodes]
-    acc_flow[np.setdiff1d(start_nodes, starting_trap_nodes)] = 1
+    acc_flow[start_nodes[start_nodes < nr_of_nodes]] = 1
 
     return acc_flow, one_or_trap_size
 
@@ -413,21 +487,26 @@ def get_traps_boundaries(traps, nx, ny, d4):
     :return trap_boundary: The trap boundary nodes in each trap
     """
 
-    indices = np.arange(0, nx * ny, 1)
-    nbrs = util.get_neighbor_indices(indices, nx, d4)
-
     # N.B: If boundary pairs to domain should be removed, include line below
     # domain_bnd_nodes = get_domain_boundary_indices(nx, ny)
 
-    trap_boundary = []
+    trap_sizes = np.asarray([len(trap) for trap in traps])
+    all_trap_nodes = np.concatenate(traps)
+    trap_nr_of_nodes = np.repeat(np.arange(len(traps)), trap_sizes)
+
+    # Which trap each node belongs to, -1 if it is not in a trap
+    trap_of = -np.ones(nx * ny, dtype=int)
+    trap_of[all_trap_nodes] = trap_nr_of_nodes
 
-    for trap in traps:
-        nbrs_for_each_node_in_trap = nbrs[trap]
-        nbr_is_in_trap = np.split(np.in1d(nbrs_for_each_node_in_trap, trap), len(trap))
-        node_is_in_trap_boundary = ~np.all(nbr_is_in_trap, axis=1)
+    # Trap nodes are never on the domain boundary, so all neighbors are inside the grid
+    nbrs = util.get_neighbor_indices(all_trap_nodes, nx, d4)
+    nbr_is_in_trap = trap_of[nbrs] == trap_nr_of_nodes[:, np.newaxis]
+    node_is_in_trap_boundary = ~np.all(nbr_is_in_trap, axis=1)
 
-        # It is not possible that no elements are in trap boundary
-        trap_boundary.append(trap[node_is_in_trap_boundary])
+    # It is not possible that no elements are in trap boundary
+    trap_boundary = np.split(all_trap_nodes[node_is_in_trap_boundary],
+                             np.cumsum(np.bincount(trap_nr_of_nodes[node_is_in_trap_boundary],
+                                                   minlength=len(traps)))[:-1])
 
     return trap_boundary
 
@@ -445,8 +524,9 @@ def get_watershed_of_node(node_coords_r_c, expanded_conn_mat, traps, r, c):
     total_nodes = r * c
     node_1d = util.map_2d_to_1d((node_coords_r_c[0], node_coords_r_c[1]), c)
     map_nodes_to_trap = util.map_nodes_to_watersheds(traps, r, c)
+    csc_mat = expanded_conn_mat.tocsc()
 
-    prev_nodes = expanded_conn_mat[:, node_1d].nonzero()[0]
+    prev_nodes = util.get_nonzero_rows_in_columns(csc_mat, [node_1d])[0]
 
     if len(prev_nodes) == 0:  # Node is trap node, or node has no upslope nodes
         node_in_trap_ix = map_nodes_to_trap[node_1d]
@@ -455,7 +535,7 @@ def get_watershed_of_node(node_coords_r_c, expanded_conn_mat, traps, r, c):
             return np.array([node_1d]), np.array([])
         else:  # Node in trap, check if trap node has upslope nodes
             trap_node = node_in_trap_ix + total_nodes
-            prev_nodes = expanded_conn_mat[:, trap_node].nonzero()[0]
+            prev_nodes = util.get_nonzero_rows_in_columns(csc_mat, [trap_node])[0]
             if len(prev_nodes) == 0:
                 return traps[node_in_trap_ix], np.array([node_in_trap_ix])
 
@@ -467,7 +547,7 @@ def get_watershed_of_node(node_coords_r_c, expanded_conn_mat, traps, r, c):
 
     watershed_of_node = [np.array([trap_node]), prev_nodes]
     while prev_nodes.size:  # Upslope nodes are added until there are no more
-        prev_nodes = expanded_conn_mat[:, prev_nodes].nonzero()[0]
+        prev_nodes = util.get_nonzero_rows_in_columns(csc_mat, prev_nodes)[0]
         if prev_nodes.size:  # No empty array is added
             watershed_of_node.append(prev_nodes)
 
@@ -513,7 +593,7 @@ def calculate_watershed_of_node(landscape, outlet_coords_r_c, d4):
 
     # Increase heights of traps and recalculate flow. Remove flow from some indices in traps.
     util.make_landscape_depressionless(watersheds, steepest, landscape)
-    print 'Made landscape depressionless'
+    print('Made landscape depressionless')
     # Test if traps are merged
     watersheds, steepest, flow_dir = util.calculate_watersheds(landscape.heights, landscape.nx, landscape.ny, landscape.step_size, d4)
     spill_heights = util.get_spill_heights(watersheds, landscape.heights, steepest)
@@ -529,7 +609,6 @@ def calculate_watershed_of_node(landscape, outlet_coords_r_c, d4):
 
     # Create connections and expand matrix to accommodate trap nodes
     node_conn_mat = util.make_sparse_node_conn_matrix(flow, landscape.ny, landscape.nx)
-    node_conn_mat = expand_conn_mat(node_conn_mat, len(traps))
     expanded_conn_mat = reroute_trap_connections(node_conn_mat, landscape.ny, landscape.nx, traps, steepest, d4)
 
     # Get the watershed of the node
@@ -557,14 +636,14 @@ def calculate_all_data(landscape, d4):
     landscape.heights = util.fill_single_cell_depressions(landscape.heights, landscape.ny, landscape.nx)
     watersheds, steepest, flow_dir = util.calculate_watersheds(landscape.heights, landscape.nx, landscape.ny, landscape.step_size, d4)
     util.make_landscape_depressionless(watersheds, steepest, landscape)
-    print 'Done making depressionless landscape'
+    print('Done making depressionless landscape')
 
     # Calculate for depressionless landscape
     watersheds, steepest, flow_direction_indices = util.calculate_watersheds(landscape.heights, landscape.nx, landscape.ny,
                                                                landscape.step_size, d4)
     spill_heights = util.get_spill_heights(watersheds, landscape.heights, steepest)
     traps, size_of_traps = util.get_all_traps(watersheds, landscape.heights, spill_heights)
-    print 'Done calculating new watersheds etc.'
+    print('Done calculating new watersheds etc.')
 
     flow_directions = util.get_flow_directions(landscape.heights, landscape.step_size, landscape.ny, landscape.nx, d4)
 
@@ -576,9 +655,8 @@ def calculate_all_data(landscape, d4):
 
     # Create connections and expand matrix to accommodate trap nodes
     node_conn_mat = util.make_sparse_node_conn_matrix(flow_direction_indices, landscape.ny, landscape.nx)
-    node_conn_mat = expand_conn_mat(node_conn_mat, len(traps))
     expanded_conn_mat = reroute_trap_connections(node_conn_mat, landscape.ny, landscape.nx, traps, steepest, d4)
-    print 'Done connectivity matrix'
+    print('Done connectivity matrix')
 
     return landscape, watersheds, steepest, flow_directions, spill_heights, traps, size_of_traps, expanded_conn_mat
 
@@ -646,7 +724,7 @@ def calculate_accumulated_flow(landscape, d4):
 
     # Make change to merge traps
     util.make_landscape_depressionless(watersheds, steepest, landscape)
-    print 'Made landscape depressionless'
+    print('Made landscape depressionless')
 
     watersheds, steepest, flow_dir = util.calculate_watersheds(landscape.heights, landscape.nx, landscape.ny,
                                                                landscape.step_size, d4)
@@ -704,7 +782,6 @@ def calculate_watershed_of_node_no_landscape_input(heights, nx, ny, step_size, o
 
     # Create connections and expand matrix to accommodate trap nodes
     node_conn_mat = util.make_sparse_node_conn_matrix(flow, ny, nx)
-    node_conn_mat = expand_conn_mat(node_conn_mat, len(traps))
     expanded_conn_mat = reroute_trap_connections(node_conn_mat, ny, nx, traps, steepest, d4)
 
     # Get the watershed of the node
@@ -717,11 +794,10 @@ def add_trap_flow_directions(flow_directions, steepest_spill_pairs):
 
     r, c = np.shape(flow_directions)
 
-    for s in steepest_spill_pairs:
-        from_ix = s[0]
-        to_ix = s[1]
-        direction = util.map_two_indices_to_flow_direction(from_ix, to_ix, c)[0]
+    if len(steepest_spill_pairs):
+        from_ix, to_ix = util.split_spill_pairs(steepest_spill_pairs)
+        directions = util.map_pairs_to_flow_direction(from_ix, to_ix, c)
 
-        flow_directions[util.map_1d_to_2d(from_ix, c)] = direction
+        flow_directions[util.map_1d_to_2d(from_ix, c)] = directions
 
     return flow_directions
@@ -1,12 +1,14 @@
 import numpy as np
 import math
-from scipy.sparse import csr_matrix, identity, csgraph, identity
+import functools
+from collections import defaultdict
+from scipy.sparse import csr_matrix, csgraph
+from numpy.lib.stride_tricks import sliding_window_view
 import itertools
-import networkx
 import time
 import matplotlib.pyplot as plt
-from operator import itemgetter
-import cPickle as pickle
+import pickle
+from numba import njit, prange
 
 
 def get_watershed_nr_by_rc(watersheds, landscape, r, c):
@@ -29,13 +31,13 @@ def fill_single_cell_depressions(heights, rows, cols):
     """
 
     nbr_heights = get_neighbor_heights(heights, rows, cols, d4=False)  # Careful for this d4=False!!!
-    delta = np.repeat(heights[1:-1, 1:-1, np.newaxis], 8, axis=2) - nbr_heights[1:-1, 1:-1]
+    delta = heights[1:-1, 1:-1, np.newaxis] - nbr_heights
     local_minima = np.where(np.max(delta, axis=2) < 0)  # The single cell depressions to be raised
 
+    raised_elevations = np.min(nbr_heights[local_minima], axis=1)  # The elevations they are raised to
+
     # Coords of local minima is for the interior, need to map to exterior
     local_minima = (local_minima[0] + 1, local_minima[1] + 1)
-
-    raised_elevations = np.min(nbr_heights[local_minima], axis=1)  # The elevations they are raised to
     heights[local_minima] = raised_elevations
 
     return heights
@@ -43,32 +45,27 @@ def fill_single_cell_depressions(heights, rows, cols):
 
 def get_neighbor_heights(heights, rows, cols, d4):
     """
-    Returns the heights of the neighbors for all nodes
+    Returns the heights of the neighbors for all interior nodes
     :param heights: Heights of the landscape
     :param rows: Number of rows in the 2D-grid
     :param cols: Number of columns in the 2D-grid
     :param d4: Use the D4-method instead of D8
-    :return nbr_heights: nx x ny x 8 grid
+    :return nbr_heights: (ny - 2) x (nx - 2) x 8 grid ((ny - 2) x (nx - 2) x 4 if d4 method)
     """
 
-    if d4:
-        nbr_heights = np.empty((rows, cols, 4), dtype=object)
+    # The 3 x 3 window around each interior node is a view of heights, the neighbors are gathered from it in one go
+    windows = sliding_window_view(np.asarray(heights), (3, 3))
 
-        nbr_heights[1:-1, 1:-1, 0] = heights[1:-1, 2:]      # 1 (2)
-        nbr_heights[1:-1, 1:-1, 1] = heights[2:, 1:-1]      # 2 (8)
-        nbr_heights[1:-1, 1:-1, 2] = heights[1:-1, 0:-2]    # 3 (32)
-        nbr_heights[1:-1, 1:-1, 3] = heights[0:-2, 1:-1]    # 4 (128)
+    if d4:
+        # Position in the window of the neighbors in direction 2, 8, 32 and 128
+        window_rows = np.array([1, 2, 1, 0])
+        window_cols = np.array([2, 1, 0, 1])
     else:
-        nbr_heights = np.empty((rows, cols, 8), dtype=object)
+        # Position in the window of the neighbors in direction 1, 2, 4, ..., 128
+        window_rows = np.array([0, 1, 2, 2, 2, 1, 0, 0])
+        window_cols = np.array([2, 2, 2, 1, 0, 0, 0, 1])
 
-        nbr_heights[1:-1, 1:-1, 0] = heights[0:-2, 2:]    # 1
-        nbr_heights[1:-1, 1:-1, 1] = heights[1:-1, 2:]    # 2
-        nbr_heights[1:-1, 1:-1, 2] = heights[2:, 2:]      # 4
-        nbr_heights[1:-1, 1:-1, 3] = heights[2:, 1:-1]    # 8
-        nbr_heights[1:-1, 1:-1, 4] = heights[2:, 0:-2]    # 16
-        nbr_heights[1:-1, 1:-1, 5] = heights[1:-1, 0:-2]  # 32
-        nbr_heights[1:-1, 1:-1, 6] = heights[0:-2, 0:-2]  # 64
-        nbr_heights[1:-1, 1:-1, 7] = heights[0:-2, 1:-1]  # 128
+    nbr_heights = windows[:, :, window_rows, window_cols]
 
     return nbr_heights
 
@@ -106,10 +103,10 @@ def get_neighbor_indices(indices, cols, d4):
 
 def get_domain_boundary_indices(cols, rows):
 
-    top = np.arange(0, cols, 1, dtype=int)
-    bottom = np.arange(cols * rows - cols, cols * rows, 1, dtype=int)
-    left = np.arange(cols, cols * rows - cols, cols, dtype=int)
-    right = np.arange(2 * cols - 1, cols * rows - 1, cols, dtype=int)
+    top = np.arange(0, cols, 1, dtype=np.int32)
+    bottom = np.arange(cols * rows - cols, cols * rows, 1, dtype=np.int32)
+    left = np.arange(cols, cols * rows - cols, cols, dtype=np.int32)
+    right = np.arange(2 * cols - 1, cols * rows - 1, cols, dtype=np.int32)
 
     boundary_indices = np.concatenate((top, bottom, left, right))
     boundary_indices.sort()
@@ -126,10 +123,10 @@ def get_domain_boundary_coords(cols, rows):
     :return boundary_coordinates: Coordinates of domain boundary
     """
 
-    top = (np.zeros(cols, dtype=int), np.arange(0, cols, 1))
-    bottom = (np.ones(cols, dtype=int) * (rows - 1), np.arange(0, cols, 1))
-    left = (np.arange(1, rows - 1, 1), np.zeros(rows - 2, dtype=int))
-    right = (np.arange(1, rows - 1, 1), np.ones(rows - 2, dtype=int) * (cols - 1))
+    top = (np.zeros(cols, dtype=np.int32), np.arange(0, cols, 1, dtype=np.int32))
+    bottom = (np.full(cols, rows - 1, dtype=np.int32), np.arange(0, cols, 1, dtype=np.int32))
+    left = (np.arange(1, rows - 1, 1, dtype=np.int32), np.zeros(rows - 2, dtype=np.int32))
+    right = (np.arange(1, rows - 1, 1, dtype=np.int32), np.full(rows - 2, cols - 1, dtype=np.int32))
 
     boundary_coordinates = (np.concatenate([top[0], bottom[0], left[0], right[0]]),
                             np.concatenate([top[1], bottom[1], left[1], right[1]]))
@@ -137,33 +134,47 @@ def get_domain_boundary_coords(cols, rows):
     return boundary_coordinates
 
 
-def get_derivatives(heights, nbr_heights, step_size, d4):
+@functools.lru_cache(maxsize=None)
+def get_inverse_neighbor_distances(step_size, d4):
     """
-    Returns the derivatives as a r x c x 8 grid, where all boundary coordinates
-    have None as derivatives. (r x c x 4 if d4 method)
-    :param heights:
-    :param nbr_heights:
+    Returns one over the distance to each neighbor, in the same order as get_neighbor_heights.
+    The array is cached per step size and is read-only.
     :param step_size: Step size in the grid
     :param d4: Use the D4-method instead of D8
-    :return derivatives: The slope to the neighbors for all nodes, nx x ny x 8 (nx x ny x 4)
+    :return inv_distance: One over the distance to each neighbor, 8 values (4 if d4 method)
     """
 
-    (r, c) = np.shape(heights)
-
+    card = step_size
     if d4:
-        delta = np.repeat(heights[1:-1, 1:-1, np.newaxis], 4, axis=2) - nbr_heights[1:-1, 1:-1]
-        distance = np.ones(4) * step_size
-        calc_derivatives = np.divide(delta, distance)
-        derivatives = np.empty((r, c, 4), dtype=object)
+        distance = np.ones(4) * card
     else:
-        card = step_size
-        delta = np.repeat(heights[1:-1, 1:-1, np.newaxis], 8, axis=2) - nbr_heights[1:-1, 1:-1]
         diag = math.sqrt(step_size ** 2 + step_size ** 2)
         distance = np.array([diag, card, diag, card, diag, card, diag, card])
-        calc_derivatives = np.divide(delta, distance)
-        derivatives = np.empty((r, c, 8), dtype=object)
+    inv_distance = 1.0 / distance
+    inv_distance.setflags(write=False)
+
+    return inv_distance
 
-    derivatives[1:-1, 1:-1] = calc_derivatives
+
+def get_derivatives(heights, nbr_heights, step_size, d4):
+    """
+    Returns the derivatives as a r x c x 8 grid, where all boundary coordinates
+    have NaN as derivatives. (r x c x 4 if d4 method)
+    :param heights: Heights of the landscape
+    :param nbr_heights: Heights of the neighbors of the interior nodes
+    :param step_size: Step size in the grid
+    :param d4: Use the D4-method instead of D8
+    :return derivatives: The slope to the neighbors for all nodes, nx x ny x 8 (nx x ny x 4)
+    """
+
+    (r, c) = np.shape(heights)
+
+    inv_distance = get_inverse_neighbor_distances(step_size, d4)
+    if np.asarray(heights).dtype == np.float32:
+        inv_distance = inv_distance.astype(np.float32)
+    delta = heights[1:-1, 1:-1, np.newaxis] - nbr_heights
+    derivatives = np.full((r, c, len(inv_distance)), np.nan, dtype=inv_distance.dtype)
+    derivatives[1:-1, 1:-1] = delta * inv_distance
 
     return derivatives
 
@@ -180,26 +191,56 @@ def get_flow_directions(heights, step_size, rows, cols, d4):
     """
 
     if d4:
-        nbr_heights = get_neighbor_heights(heights, rows, cols, d4=True)
-        derivatives = get_derivatives(heights, nbr_heights, step_size, d4=True)
+        # Same neighbor order as get_neighbor_heights, given as offsets from the node
+        nbr_rows = np.array([0, 1, 0, -1])
+        nbr_cols = np.array([1, 0, -1, 0])
+        codes = np.array([1, 2, 3, 4], dtype=np.int16)
     else:
-        nbr_heights = get_neighbor_heights(heights, rows, cols, d4=False)
-        derivatives = get_derivatives(heights, nbr_heights, step_size, d4=False)
+        nbr_rows = np.array([-1, 0, 1, 1, 1, 0, -1, -1])
+        nbr_cols = np.array([1, 1, 1, 0, -1, -1, -1, 0])
+        codes = np.array([1, 2, 4, 8, 16, 32, 64, 128], dtype=np.int16)
 
-    flow_directions = np.empty((rows, cols), dtype=object)
-    flow_directions[1:-1, 1:-1] = -1
+    interior_directions = np.empty((rows - 2, cols - 2), dtype=np.int16)
+    inv_distance = get_inverse_neighbor_distances(step_size, d4)
+    _steepest_directions(np.asarray(heights), nbr_rows, nbr_cols, inv_distance, codes, interior_directions)
 
-    pos_derivatives = np.max(derivatives, axis=2) > 0
-    flow_directions[pos_derivatives] = np.argmax(derivatives, axis=2)[pos_derivatives]
-
-    if not d4:
-        flow_directions[pos_derivatives] = 2 ** flow_directions[pos_derivatives]
-    else:
-        flow_directions[pos_derivatives] += 1
+    # The boundary has no flow direction, and is marked with -1 like the minima and flat areas
+    flow_directions = np.full((rows, cols), -1, dtype=np.int32)
+    flow_directions[1:-1, 1:-1] = interior_directions
 
     return flow_directions
 
 
+@njit(cache=True, parallel=True)
+def _steepest_directions(heights, nbr_rows, nbr_cols, inv_distance, codes, interior_directions):
+    """
+    Finds the steepest downslope direction of each interior node in one pass over the grid
+    :param heights: The heights for all nodes in the 2D-grid
+    :param nbr_rows: Row offset to each neighbor
+    :param nbr_cols: Column offset to each neighbor
+    :param inv_distance: One over the distance to each neighbor
+    :param codes: The flow direction code of each neighbor
+    :param interior_directions: The flow direction of each interior node, -1 for local minima and flat areas
+    :return: Void function that alters interior_directions
+    """
+
+    rows, cols = heights.shape
+    for r in prange(1, rows - 1):
+        for c in range(1, cols - 1):
+            # The first of several equally steep neighbors is chosen
+            steepest = 0
+            max_derivative = (heights[r, c] - heights[r + nbr_rows[0], c + nbr_cols[0]]) * inv_distance[0]
+            for k in range(1, len(codes)):
+                derivative = (heights[r, c] - heights[r + nbr_rows[k], c + nbr_cols[k]]) * inv_distance[k]
+                if derivative > max_derivative:
+                    max_derivative = derivative
+                    steepest = k
+            if max_derivative > 0:
+                interior_directions[r - 1, c - 1] = codes[steepest]
+            else:
+                interior_directions[r - 1, c - 1] = -1
+
+
 def make_sparse_node_conn_matrix(flow_direction_indices, rows, cols):
     """
     Returns a sparse connectivity matrix for the nodes using information about flow directions
@@ -211,16 +252,15 @@ def make_sparse_node_conn_matrix(flow_direction_indices, rows, cols):
 
     flow_to = np.reshape(flow_direction_indices, rows * cols)
 
-    # Remove -1 and None indices
-    indices = np.arange(0, rows * cols, 1)
+    # Remove -1 indices
     keep_indices = flow_to > 0
 
-    # Data for csr-matrix
-    flow_from = indices[keep_indices]
-    flow_to = flow_to[keep_indices]
-    data = np.ones(len(flow_from), dtype=int)
+    # The rows are already in order and have at most one element each, so the csr-arrays are built directly
+    indptr = np.concatenate(([0], np.cumsum(keep_indices))).astype(np.int32)
+    indices = flow_to[keep_indices].astype(np.int32)
+    data = np.ones(len(indices), dtype=np.int8)
 
-    node_conn_mat = csr_matrix((data, (flow_from, flow_to)), shape=(rows * cols, rows * cols))
+    node_conn_mat = csr_matrix((data, indices, indptr), shape=(rows * cols, rows * cols))
 
     return node_conn_mat
 
@@ -240,18 +280,11 @@ def remove_out_of_boundary_flow(flow_directions, d4):
         change_bottom = np.where(flow_directions[-2, :] == 2)[0]
         change_left = np.where(flow_directions[:, 1] == 3)[0]
     else:
-        change_top = np.concatenate((np.where(flow_directions[1, :] == 1)[0],
-                                    np.where(flow_directions[1, :] == 64)[0],
-                                    np.where(flow_directions[1, :] == 128)[0]))
-        change_right = np.concatenate((np.where(flow_directions[:, -2] == 1)[0],
-                                      np.where(flow_directions[:, -2] == 2)[0],
-                                      np.where(flow_directions[:, -2] == 4)[0]))
-        change_bottom = np.concatenate((np.where(flow_directions[-2, :] == 4)[0],
-                                       np.where(flow_directions[-2, :] == 8)[0],
-                                       np.where(flow_directions[-2, :] == 16)[0]))
-        change_left = np.concatenate((np.where(flow_directions[:, 1] == 16)[0],
-                                     np.where(flow_directions[:, 1] == 32)[0],
-                                     np.where(flow_directions[:, 1] == 64)[0]))
+        # The D8 codes are single bits, so the three directions out of each edge are tested with one mask
+        change_top = get_flow_in_directions(flow_directions[1, :], 1 | 64 | 128)
+        change_right = get_flow_in_directions(flow_directions[:, -2], 1 | 2 | 4)
+        change_bottom = get_flow_in_directions(flow_directions[-2, :], 4 | 8 | 16)
+        change_left = get_flow_in_directions(flow_directions[:, 1], 16 | 32 | 64)
 
     flow_directions[1, change_top] = -1
     flow_directions[change_right, -2] = -1
@@ -261,10 +294,24 @@ def remove_out_of_boundary_flow(flow_directions, d4):
     # This function does not return something, just change the input flow_directions
 
 
+def get_flow_in_directions(flow_directions, direction_mask):
+    """
+    Returns the positions in a 1d-array of D8 flow directions where the flow goes in one of the masked directions
+    :param flow_directions: D8 flow directions, -1 where there is no flow
+    :param direction_mask: Bitwise or of the direction codes
+    :return positions: Positions with flow in one of the directions
+    """
+
+    codes = np.asarray(flow_directions, dtype=int)
+    positions = np.flatnonzero((codes > 0) & ((codes & direction_mask) != 0))
+
+    return positions
+
+
 def get_flow_direction_indices(heights, step_size, rows, cols, d4):
     """
     For every coordinate specifies the next index it flows to. If no flow, the index is set as -1.
-    All boundary nodes have a flow set to None, as there's not enough information to determine.
+    All boundary nodes have a flow set to -1, as there's not enough information to determine.
     :param heights: Heights of grid
     :param step_size: Length between grid points
     :param rows: Nodes in y-direction
@@ -280,22 +327,39 @@ def get_flow_direction_indices(heights, step_size, rows, cols, d4):
         flow_directions = get_flow_directions(heights, step_size, rows, cols, d4=False)
         remove_out_of_boundary_flow(flow_directions, d4=False)
 
-    # Copy flow directions, and write to that array
-    flow_direction_indices = np.copy(flow_directions)
+    flow_direction_indices = map_flow_directions_to_indices(flow_directions, rows, cols, d4)
+
+    return flow_direction_indices
+
+
+def map_flow_directions_to_indices(flow_directions, rows, cols, d4):
+    """
+    Map the flow direction of every interior node to the index it flows to. If no flow, the index is set as -1.
+    :param flow_directions: The directions of flow for every node, -1 at the boundary
+    :param rows: Nodes in y-direction
+    :param cols: Nodes in x-direction
+    :param d4: Use the D4-method instead of D8
+    :return flow_direction_indices: Next node it flows to
+    """
+
+    # The boundary nodes have no flow
+    flow_direction_indices = np.full((rows, cols), -1, dtype=np.int32)
 
+    # Lookup table from flow direction to the translation of the index
     if d4:
         values = [1, 2, 3, 4]
         translations = [1, cols, -1, -cols]
     else:
         values = [1, 2, 4, 8, 16, 32, 64, 128]
         translations = [-cols + 1, 1, cols + 1, cols, cols - 1, -1, -cols - 1, -cols]
+    translation_of_value = np.zeros(values[-1] + 1, dtype=int)
+    translation_of_value[values] = translations
 
-    for ix in range(len(values)):
-        coords = np.where(flow_directions == values[ix])
-        if len(coords[0]) > 0:
-            from_ix = coords[0] * cols + coords[1]
-            to_ix = from_ix + translations[ix]
-            flow_direction_indices[coords] = to_ix
+    interior_directions = flow_directions[1:-1, 1:-1].astype(int)
+    interior_indices = np.arange(rows * cols).reshape(rows, cols)[1:-1, 1:-1]
+    has_flow = interior_directions > 0  # Nodes without flow look up translation 0, and are set to -1
+    flow_direction_indices[1:-1, 1:-1] = np.where(has_flow, interior_indices +
+                                                  translation_of_value[interior_directions * has_flow], -1)
 
     return flow_direction_indices
 
@@ -321,8 +385,7 @@ def map_1d_to_2d(indices, cols):
     :return rows, cols: Tuple containing the row and col indices
     """
 
-    rows = np.divide(indices, cols)
-    cols = (indices % cols)
+    rows, cols = np.divmod(indices, cols)
 
     return rows, cols
 
@@ -331,88 +394,80 @@ def get_node_endpoints(downslope_neighbors):
     """
     Returns a 2d array specifying node endpoint for the coordinate
     :param downslope_neighbors: Downslope index for each coordinate
-    :return terminal_nodes: The end point for each node
+    :return terminal_nodes: The end point for each node. -1 at the boundary, -3 if the flow ends at the boundary
     """
 
     rows, cols = np.shape(downslope_neighbors)
-    domain_boundary = get_domain_boundary_coords(cols, rows)
-
-    terminal_nodes = np.empty((rows, cols), dtype=object)
-
-    # Get all minima as starting points for stepwise algorithm
-    minima = np.where(downslope_neighbors == -1)
-    terminal_nodes[minima] = map_2d_to_1d(minima, cols)
-    terminal_nodes[domain_boundary] = -2  # Finding terminal nodes is harder with None at the boundary
-
-    num_inserted = len(minima[0])
-
-    while num_inserted > 0:
-        num_inserted, terminal_nodes = update_terminal_nodes(terminal_nodes, downslope_neighbors, cols)
+    nr_of_nodes = rows * cols
+    is_boundary = np.zeros(nr_of_nodes, dtype=bool)
+    is_boundary[get_domain_boundary_indices(cols, rows)] = True
 
-    terminal_nodes[domain_boundary] = None
+    # Minima and the boundary nodes point to themselves, all other nodes to their downslope neighbor
+    endpoints = np.arange(nr_of_nodes)
+    downslope = np.reshape(downslope_neighbors, nr_of_nodes)[~is_boundary].astype(int)
+    endpoints[~is_boundary] = np.where(downslope == -1, endpoints[~is_boundary], downslope)
 
-    return terminal_nodes
+    # Pointer jumping, each step doubles the distance followed downslope
+    next_endpoints = endpoints[endpoints]
+    while not np.array_equal(next_endpoints, endpoints):
+        endpoints = next_endpoints
+        next_endpoints = endpoints[endpoints]
 
+    terminal_nodes = endpoints.astype(np.int32)
+    terminal_nodes[is_boundary[endpoints]] = -3  # Flow ending at the boundary has no terminal node
+    terminal_nodes[is_boundary] = -1
 
-def update_terminal_nodes(terminal_nodes, downslope_neighbors, cols):
-    """
-    Help method for get_node_endpoints. Returns updated terminal nodes.
-    :param terminal_nodes: Array specifying endpoint for each node
-    :param downslope_neighbors: Downslope index for each coordinate
-    :param cols: Nr of nodes in x-direction
-    :return num_inserted, terminal_nodes: Nr of new coords with detected endpoint. 2d-array indicating endpoints
-    """
-
-    no_terminal_nodes = np.where(terminal_nodes < -2)  # Indices of all nodes without terminal nodes yet
+    return terminal_nodes.reshape(rows, cols)
 
-    if len(no_terminal_nodes[0]) == 0:
-        return 0, terminal_nodes
-    next_nodes = downslope_neighbors[no_terminal_nodes]  # Check if these nodes are minima, or if they have endpoints
 
-    # The next point is a minimum
-    next_nodes = next_nodes.astype(int)  # Mapping for type object doesn't work
-    are_minima = np.where(downslope_neighbors[map_1d_to_2d(next_nodes, cols)] == -1)[0]
-    terminal_nodes[(no_terminal_nodes[0][are_minima], no_terminal_nodes[1][are_minima])] = next_nodes[are_minima]
-
-    # The next point might have an end node
-    undecided = np.setdiff1d(range(len(next_nodes)), are_minima)  # Might be nodes already assigned end points
-    are_end_points = undecided[np.where(terminal_nodes[map_1d_to_2d(next_nodes[undecided], cols)] >= 0)[0]]
-    terminal_nodes[(no_terminal_nodes[0][are_end_points], no_terminal_nodes[1][are_end_points])] = \
-        terminal_nodes[map_1d_to_2d(next_nodes[are_end_points], cols)]
-
-    num_inserted = len(are_minima) + len(are_end_points)
+def get_local_watersheds(node_endpoints):
 
-    return num_inserted, terminal_nodes
+    endpoints = node_endpoints.flatten()
 
+    # Nodes with a negative endpoint are boundary nodes (-1) or flow out of the domain (-3), and aren't of interest.
+    # The node indices, and therefore all watersheds built from them, are int32
+    has_endpoint = endpoints >= 0
+    indices = np.arange(len(endpoints), dtype=np.int32)[has_endpoint]
+    endpoints = endpoints[has_endpoint].astype(int)
 
-def get_local_watersheds(node_endpoints):
+    if len(endpoints) == 0:
+        return {}
 
-    endpoints = node_endpoints.flatten()
-    unique, counts = np.unique(endpoints, return_counts=True)
-    sorted_indices = np.argsort(endpoints)
-    indices_to_endpoints = np.split(sorted_indices, np.cumsum(counts))[0:-1]
+    # The endpoints are node indices, so they are counted directly instead of sorted by np.unique
+    counts = np.bincount(endpoints)
+    unique = np.flatnonzero(counts)
+    sorted_indices = indices[np.argsort(endpoints, kind="stable")]
+    indices_to_endpoints = np.split(sorted_indices, np.cumsum(counts[unique])[:-1])
 
     local_watersheds = dict(zip(unique, indices_to_endpoints))
-    del local_watersheds[None]  # All nodes with None as endpoint aren't of interest
 
     return local_watersheds
 
 
 def map_1d_interior_to_2d_exterior(node_index, number_of_cols):
+    """
+    Map from 1d-indices of the interior to coordinates in the whole grid
+    :param node_index: Indices in the interior
+    :param number_of_cols: Nr of columns in the interior
+    :return row_col: Int array with one (row, col) pair per index
+    """
 
-    r = node_index/number_of_cols + 1
-    c = node_index % number_of_cols + 1
-    row_col = zip(r, c)
+    rows, cols = np.divmod(np.asarray(node_index), number_of_cols)
+    row_col = np.column_stack((rows + 1, cols + 1))
 
     return row_col
 
 
 def map_2d_exterior_to_1d_interior(coords, cols):
+    """
+    Map from coordinates in the whole grid to 1d-indices of the interior
+    :param coords: The (row, col) pairs in the whole grid
+    :param cols: Nr of columns in the interior
+    :return indices: Int array of the indices in the interior
+    """
 
-    indices = []
-    for c in coords:
-        ix = c[1] - 1 + (c[0] - 1) * cols
-        indices.append(ix)
+    coords = np.asarray(coords).reshape(-1, 2)
+    indices = (coords[:, 1] - 1) + (coords[:, 0] - 1) * cols
 
     return indices
 
@@ -453,7 +508,9 @@ def combine_minima(local_minima, rows, cols, d4):
     from_min = np.concatenate([local_minima for i in range(8)])
 
     # Only keep connections between minima
-    nbrs_are_minima = np.where(np.in1d(nbrs_to_minima_1d, local_minima))[0]
+    is_minimum = np.zeros(rows * cols, dtype=bool)
+    is_minimum[local_minima] = True
+    nbrs_are_minima = np.where(is_minimum[nbrs_to_minima_1d])[0]
     to_min = nbrs_to_minima_1d[nbrs_are_minima]
     from_min = from_min[nbrs_are_minima]
     data = np.ones(len(to_min), dtype=int)
@@ -488,18 +545,68 @@ def combine_watersheds(local_watersheds, combined_minima):
     :return watersheds: The combined watersheds
     """
 
-    watersheds = []
+    watersheds = concatenate_local_watersheds(local_watersheds, combined_minima)
+
+    return watersheds
+
+
+def concatenate_local_watersheds(local_watersheds, groups_of_minima):
+    """
+    Concatenate the local watersheds of each group of minima. All watersheds are assembled in one
+    array, and each returned watershed is a view into it.
+    :param local_watersheds: Dictionary where the minimum is key and the nodes leading to it are the value
+    :param groups_of_minima: Collection of minima that are combined into one watershed
+    :return watersheds: The combined watershed of each group
+    """
+
+    if len(local_watersheds) == 0:
+        return []
 
-    for i in range(len(combined_minima)):
-        if len(combined_minima[i]) == 1:
-            watersheds.append(local_watersheds[list(combined_minima[i])[0]])
-        else:
-            ws = np.concatenate(list((local_watersheds[i] for i in combined_minima[i])))
-            watersheds.append(ws)
+    minima = list(local_watersheds.keys())
+    position_of_minimum = {m: i for i, m in enumerate(minima)}
+    local_sizes = np.array([len(local_watersheds[m]) for m in minima], dtype=np.int64)
+    local_ptr = np.concatenate(([0], np.cumsum(local_sizes)))
+    local_data = np.concatenate([local_watersheds[m] for m in minima])
+
+    group_members = np.array([position_of_minimum[m] for group in groups_of_minima for m in group], dtype=np.int64)
+    group_sizes = np.array([len(group) for group in groups_of_minima], dtype=np.int64)
+    group_ptr = np.concatenate(([0], np.cumsum(group_sizes)))
+
+    # The length of each group is the difference of the running member sizes at the group boundaries
+    member_ptr = np.concatenate(([0], np.cumsum(local_sizes[group_members])))
+    lengths = member_ptr[group_ptr[1:]] - member_ptr[group_ptr[:-1]]
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    out = np.empty(offsets[-1], dtype=local_data.dtype)
+    _fill_buckets(local_data, local_ptr, group_members, group_ptr, offsets, out)
+
+    watersheds = [out[offsets[i]:offsets[i + 1]] for i in range(len(groups_of_minima))]
 
     return watersheds
 
 
+@njit(cache=True)
+def _fill_buckets(local_data, local_ptr, group_members, group_ptr, offsets, out):
+    """
+    Copies the local watersheds of each group into the group's slot in out
+    :param local_data: All local watersheds after each other
+    :param local_ptr: Start of each local watershed in local_data
+    :param group_members: Position of the local watersheds in each group, group after group
+    :param group_ptr: Start of each group in group_members
+    :param offsets: Start of each group in out
+    :param out: The combined watersheds after each other
+    :return: Void function that alters out
+    """
+
+    for g in range(len(group_ptr) - 1):
+        k = offsets[g]
+        for j in range(group_ptr[g], group_ptr[g + 1]):
+            m = group_members[j]
+            for i in range(local_ptr[m], local_ptr[m + 1]):
+                out[k] = local_data[i]
+                k += 1
+
+
 def create_nbr_connectivity_matrix(flow_directions, nx, ny, d4):
     # Note: This is a version without 1 on the diagonal
     """
@@ -517,25 +624,8 @@ def create_nbr_connectivity_matrix(flow_directions, nx, ny, d4):
     else:
         remove_out_of_boundary_flow(flow_directions, d4=False)
 
-    values = [1, 2, 4, 8, 16, 32, 64, 128]
-    translations = [-nx + 1, 1, nx + 1, nx, nx - 1, -1, -nx - 1, -nx]
-    from_indices = []
-    to_indices = []
-    total_nodes = nx * ny
-
-    for ix in range(len(values)):
-        coords = np.where(flow_directions == values[ix])
-        if len(coords[0]) > 0:
-            from_ix = coords[0] * nx + coords[1]
-            to_ix = from_ix + translations[ix]
-            from_indices.append(from_ix)
-            to_indices.append(to_ix)
-
-    rows = np.concatenate(from_indices)
-    cols = np.concatenate(to_indices)
-    data = np.ones(len(rows))
-
-    adj_mat = csr_matrix((data, (rows, cols)), shape=(total_nodes, total_nodes))
+    flow_direction_indices = map_flow_directions_to_indices(flow_directions, ny, nx, d4)
+    adj_mat = make_sparse_node_conn_matrix(flow_direction_indices, ny, nx)
 
     return adj_mat
 
@@ -559,22 +649,73 @@ def get_downslope_rivers(adj_mat):
     :return downslope_rivers: Sparse matrix with ones at downslope nodes
     """
 
+    adj_mat = csr_matrix(adj_mat)
+    adj_mat.eliminate_zeros()
     rows, cols = np.shape(adj_mat)
-    changes = True
-    id_matrix = identity(rows, dtype=int, format='csr')
-    downslope_rivers = adj_mat + id_matrix  # Set diagonal to 1
 
-    AA = adj_mat
+    # Each node flows to at most one other node, so the downslope nodes form a path
+    successor = -np.ones(rows, dtype=int)
+    has_successor = np.diff(adj_mat.indptr) > 0
+    successor[has_successor] = adj_mat.indices[adj_mat.indptr[:-1][has_successor]]
+
+    # Find the length of each path by pointer jumping, doubling the distance covered in each step
+    path_length = has_successor.astype(int)
+    jump = successor.copy()
+    jumping = np.where(jump >= 0)[0]
+    while len(jumping) > 0:
+        path_length[jumping] += path_length[jump[jumping]]
+        jump[jumping] = jump[jump[jumping]]
+        jumping = jumping[jump[jumping] >= 0]
+
+    # Every node is downslope of itself
+    indptr = np.concatenate(([0], np.cumsum(path_length + 1)))
+    indices = np.empty(indptr[-1], dtype=int)
+    _fill_downslope_paths(successor, indptr, indices)
+    downslope_rivers = csr_matrix((np.ones(len(indices), dtype=np.int8), indices, indptr), shape=(rows, cols))
+    downslope_rivers.sort_indices()
 
-    while changes:
-        changes = False
-        AA = csr_matrix.dot(AA, adj_mat)
+    return downslope_rivers
 
-        if AA.nnz > 0:
-            changes = True
-            downslope_rivers = AA + downslope_rivers
 
-    return downslope_rivers
+@njit(cache=True)
+def _fill_downslope_paths(successor, indptr, indices):
+    """
+    Writes the path of downslope nodes from each node into the csr-arrays
+    :param successor: The node each node flows to, -1 if none
+    :param indptr: Index pointer of the csr-matrix, sized by the path lengths
+    :param indices: Column indices of the csr-matrix
+    :return: Void function that alters indices
+    """
+
+    for i in range(len(successor)):
+        node = i
+        for k in range(indptr[i], indptr[i + 1]):
+            indices[k] = node
+            node = successor[node]
+
+
+def get_nonzero_rows_in_columns(csc_mat, columns):
+    """
+    Same result as csr_mat[:, columns].nonzero(), but reads directly from a precomputed csc-matrix
+    :param csc_mat: Sparse matrix in csc format
+    :param columns: Indices of the columns of interest
+    :return rows, column_indices: Row of each nonzero element, and its position in columns
+    """
+
+    columns = np.asarray(columns, dtype=int)
+    starts = csc_mat.indptr[columns]
+    counts = csc_mat.indptr[columns + 1] - starts
+
+    # Position of every element of the selected columns in csc_mat.indices
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    positions = np.arange(np.sum(counts)) + offsets
+    column_indices = np.repeat(np.arange(len(columns)), counts)
+
+    is_nonzero = csc_mat.data[positions] != 0
+    rows = csc_mat.indices[positions[is_nonzero]]
+    column_indices = column_indices[is_nonzero]
+
+    return rows, column_indices
 
 
 def get_row_and_col_from_indices(node_indices, number_of_cols):
@@ -585,18 +726,15 @@ def get_row_and_col_from_indices(node_indices, number_of_cols):
     :return row_col: (r, c) for every index
     """
 
-    row_col = np.empty((len(node_indices), 2), dtype=int)
-    row_col[:, 0] = np.divide(node_indices, number_of_cols)
-    row_col[:, 1] = node_indices % number_of_cols
+    row_col = np.empty((len(node_indices), 2), dtype=np.int32)
+    np.divmod(node_indices, number_of_cols, out=(row_col[:, 0], row_col[:, 1]))
 
     return row_col
 
 
 def get_watersheds_with_combined_minima(combined_minima, local_watersheds):
 
-    watersheds = []
-    for c in combined_minima:
-        watersheds.append(np.concatenate([local_watersheds[el] for el in c]))
+    watersheds = concatenate_local_watersheds(local_watersheds, combined_minima)
 
     return watersheds
 
@@ -612,72 +750,80 @@ def get_boundary_pairs_in_watersheds(watersheds, nx, ny, d4):
     :return boundary_pairs: List of lists where each list contain a tuple of two arrays
     """
 
-    indices = np.arange(0, nx * ny, 1)
-    if d4:
-        nbrs = get_neighbor_indices(indices, nx, d4=True)
-    else:
-        nbrs = get_neighbor_indices(indices, nx, d4=False)
-
     # N.B: If boundary pairs to domain should be removed, include line below
     # domain_bnd_nodes = get_domain_boundary_indices(nx, ny)
 
-    boundary_pairs = []
-
-    for watershed in watersheds:
-
-        watershed = np.sort(watershed)
-        nbrs_for_ws = nbrs[watershed]
-        nbrs_for_ws_1d = np.concatenate(nbrs_for_ws)
-
-        # Find nodes not in the watershed which aren't at the domain boundary
-        not_in_watershed_arr = np.in1d(nbrs_for_ws_1d, watershed, invert=True)
-
-        # N.B: If boundary pairs to domain should be removed, include lines below
-        # at_dom_boundary = np.in1d(nbrs_for_ws_1d, domain_bnd_nodes)
-        # valid_nodes = np.where((not_in_watershed_arr - at_dom_boundary) == True)[0]
-
-        # Pairs in from-to format
-        if d4:
-            repeat_from = np.repeat(watershed, 4)
-        else:
-            repeat_from = np.repeat(watershed, 8)
-        from_indices = repeat_from[not_in_watershed_arr]
-        to_indices = nbrs_for_ws_1d[not_in_watershed_arr]
-        boundary_pairs_for_ws = [from_indices, to_indices]
-        boundary_pairs.append(boundary_pairs_for_ws)
+    # All watershed nodes in one array, sorted within each watershed
+    all_nodes, ws_sizes = get_all_watershed_nodes(watersheds)
+    ws_nr_of_nodes = np.repeat(np.arange(len(watersheds)), ws_sizes)
+    order = np.lexsort((all_nodes, ws_nr_of_nodes))
+    all_nodes = all_nodes[order]
+    ws_nr_of_nodes = ws_nr_of_nodes[order]
+
+    # Which watershed each node is in, -1 if none
+    watershed_of = -np.ones(nx * ny, dtype=int)
+    watershed_of[all_nodes] = ws_nr_of_nodes
+
+    nbrs = get_neighbor_indices(all_nodes, nx, d4)
+    nbrs_in_grid = np.clip(nbrs, 0, nx * ny - 1)
+    is_in_same_watershed = ((nbrs == nbrs_in_grid) &
+                            (watershed_of[nbrs_in_grid] == ws_nr_of_nodes[:, np.newaxis])).ravel()
+
+    # N.B: If boundary pairs to domain should be removed, include lines below
+    # at_dom_boundary = np.isin(nbrs.ravel(), domain_bnd_nodes)
+    # is_in_same_watershed = is_in_same_watershed | at_dom_boundary
+
+    # Pairs in from-to format
+    from_indices = np.repeat(all_nodes, nbrs.shape[1])[~is_in_same_watershed]
+    to_indices = nbrs.ravel()[~is_in_same_watershed]
+    split_at = np.cumsum(np.bincount(np.repeat(ws_nr_of_nodes, nbrs.shape[1])[~is_in_same_watershed],
+                                     minlength=len(watersheds)))[:-1]
+    boundary_pairs = [[from_ws, to_ws] for from_ws, to_ws in zip(np.split(from_indices, split_at),
+                                                                 np.split(to_indices, split_at))]
 
     return boundary_pairs
 
 
-def get_boundary_pairs_for_specific_watersheds(specific_watersheds, nx, d4):
+def get_boundary_pairs_for_specific_watersheds(specific_watersheds, nx, d4, nbrs_all=None, mapping=None):
     """
     Only find boundary pairs for specified watersheds.
     :param specific_watersheds: Selection of watersheds
     :param nx: Number of nodes in x-direction
     :param d4: Use the D4-method instead of D8
+    :param nbrs_all: Neighbor indices of all nodes in the grid. Computed for the watershed nodes if not given
+    :param mapping: Watershed nr of each node in the grid, different for each of the specific watersheds.
+    Built from specific_watersheds if not given
     :return boundary_pairs: Boundary pairs for specified watersheds
     """
 
-    boundary_pairs = []
-
-    for watershed in specific_watersheds:
-
-        if d4:
-            nbrs = get_neighbor_indices(watershed, nx, d4=True)
-        else:
-            nbrs = get_neighbor_indices(watershed, nx, d4=False)
-        nbrs_for_ws_1d = np.concatenate(nbrs)
-        valid_nodes = np.in1d(nbrs_for_ws_1d, watershed, invert=True)
+    if len(specific_watersheds) == 0:
+        return []
 
-        # Pairs in from-to format
-        if d4:
-            repeat_from = np.repeat(watershed, 4)
-        else:
-            repeat_from = np.repeat(watershed, 8)
-        from_indices = repeat_from[valid_nodes]
-        to_indices = nbrs_for_ws_1d[valid_nodes]
-        boundary_pairs_for_ws = [from_indices, to_indices]
-        boundary_pairs.append(boundary_pairs_for_ws)
+    # All nodes of the specific watersheds at once, in the same order as the watersheds
+    all_nodes, ws_sizes = get_all_watershed_nodes(specific_watersheds)
+    if nbrs_all is not None:
+        nbrs = nbrs_all[all_nodes]
+    else:
+        nbrs = get_neighbor_indices(all_nodes, nx, d4)
+
+    if mapping is None:
+        # Neighbors can lie up to nx + 1 outside the nodes, which the clipping below treats as other watersheds
+        mapping = np.full(np.max(all_nodes) + nx + 2, -1, dtype=np.int32)
+        mapping[all_nodes] = np.repeat(np.arange(len(specific_watersheds), dtype=np.int32), ws_sizes)
+
+    # A pair goes from a node to a neighbor outside its watershed
+    nbrs_in_range = np.clip(nbrs, 0, len(mapping) - 1)
+    is_in_same_watershed = ((nbrs == nbrs_in_range) &
+                            (mapping[nbrs_in_range] == mapping[all_nodes][:, np.newaxis])).ravel()
+
+    # Pairs in from-to format
+    from_indices = np.repeat(all_nodes, nbrs.shape[1])[~is_in_same_watershed]
+    to_indices = nbrs.ravel()[~is_in_same_watershed]
+    ws_nr_of_nodes = np.repeat(np.arange(len(specific_watersheds)), ws_sizes)
+    split_at = np.cumsum(np.bincount(np.repeat(ws_nr_of_nodes, nbrs.shape[1])[~is_in_same_watershed],
+                                     minlength=len(specific_watersheds)))[:-1]
+    boundary_pairs = [[from_ws, to_ws] for from_ws, to_ws in zip(np.split(from_indices, split_at),
+                                                                 np.split(to_indices, split_at))]
 
     return boundary_pairs
 
@@ -691,7 +837,7 @@ def get_possible_spill_pairs(heights, boundary_pairs):
     """
 
     rows, cols = np.shape(heights)
-    heights = np.reshape(heights, rows * cols)
+    heights = np.ravel(heights)
     heights_pairs = [heights[np.vstack((arr[0], arr[1]))] for arr in boundary_pairs]
 
     # Min(max elevation of each pair)
@@ -714,24 +860,59 @@ def get_steepest_spill_pair(heights, spill_pairs, d4):
     :return steepest_spill_pairs: Set containing the steepest spill pairs
     """
 
+    steepest_spill_pairs = get_steepest_spill_pair_array(heights, spill_pairs, d4)
+
+    return set(zip(steepest_spill_pairs[:, 0].tolist(), steepest_spill_pairs[:, 1].tolist()))
+
+
+def get_steepest_spill_pair_array(heights, spill_pairs, d4):
+    """
+    Return the steepest spill pair for each watershed as an array of from-to rows
+    :param heights: Heights of terrain
+    :param spill_pairs: List of lists. Each list contains two arrays in from-to format
+    :param d4: Use the D4-method instead of D8
+    :return steepest_spill_pairs: Int array with one (from_node, to_node) row for each watershed
+    """
+
     rows, cols = np.shape(heights)
-    heights = np.reshape(heights, rows * cols)
-    steepest_spill_pairs = [None] * len(spill_pairs)
+    heights = np.ravel(heights)
+    if len(spill_pairs) == 0:
+        return np.empty((0, 2), dtype=int)
+
+    # Handle the spill pairs of all watersheds at once, keeping track of which watershed each pair belongs to
+    pair_counts = np.array([len(pair[0]) for pair in spill_pairs])
+    # Each watershed has at least one possible spill pair, the one at its lowest boundary, so no group is empty
+    assert np.all(pair_counts > 0)
+    groups = np.repeat(np.arange(len(spill_pairs)), pair_counts)
+    spill_from = np.concatenate([pair[0] for pair in spill_pairs]).astype(int)
+    spill_to = np.concatenate([pair[1] for pair in spill_pairs]).astype(int)
 
-    for i in range(len(spill_pairs)):
-        diff = abs(spill_pairs[i][0] - spill_pairs[i][1])
-        derivatives = np.array([None] * len(spill_pairs[i][0]), dtype=object)
+    diff = np.abs(spill_from - spill_to)
+    distance = np.where(np.logical_or(diff == 1, diff == cols), 10.0, math.sqrt(200))
+    derivatives = (heights[spill_from] - heights[spill_to]) / distance
 
-        card_indices = np.where(np.logical_or(diff == 1, diff == cols))[0]
-        diag_indices = np.setdiff1d(np.arange(0, len(spill_pairs[i][0]), 1), card_indices)
-        card_der = (heights[spill_pairs[i][0][card_indices]] - heights[spill_pairs[i][1][card_indices]])/10.0
-        diag_der = (heights[spill_pairs[i][0][diag_indices]] - heights[spill_pairs[i][1][diag_indices]])/math.sqrt(200)
-        derivatives[card_indices] = card_der
-        derivatives[diag_indices] = diag_der
-        max_index = np.argmax(derivatives)
-        steepest_spill_pairs[i] = (spill_pairs[i][0][max_index], spill_pairs[i][1][max_index])
+    # Sort by watershed, then by descending derivative. The sort is stable, so ties keep the first pair.
+    order = np.lexsort((-derivatives, groups))
+    first_in_group = np.concatenate(([0], np.cumsum(pair_counts)[:-1]))
+    steepest = order[first_in_group]
 
-    return set(steepest_spill_pairs)
+    return np.column_stack((spill_from[steepest], spill_to[steepest]))
+
+
+def get_all_watershed_nodes(watersheds):
+    """
+    Returns the nodes of all watersheds in one array, together with the size of each watershed
+    :param watersheds: List of arrays containing watersheds
+    :return all_nodes: The nodes of all watersheds, one watershed after the other
+    :return ws_sizes: Nr of nodes in each watershed
+    """
+
+    ws_sizes = np.fromiter(map(len, watersheds), dtype=int, count=len(watersheds))
+    if len(watersheds) == 0:
+        return np.array([], dtype=int), ws_sizes
+    all_nodes = np.concatenate(watersheds)
+
+    return all_nodes, ws_sizes
 
 
 def map_nodes_to_watersheds(watersheds, rows, cols):
@@ -743,45 +924,112 @@ def map_nodes_to_watersheds(watersheds, rows, cols):
     :return mapping_nodes_to_watersheds: Array where index gives watershed nr
     """
 
-    mapping_nodes_to_watersheds = np.ones(rows * cols, dtype=int) * -1
+    mapping_nodes_to_watersheds = np.full(rows * cols, -1, dtype=np.int32)
 
-    for i in range(len(watersheds)):
-        mapping_nodes_to_watersheds[watersheds[i]] = i
+    all_nodes, ws_sizes = get_all_watershed_nodes(watersheds)
+    mapping_nodes_to_watersheds[all_nodes] = np.repeat(np.arange(len(watersheds), dtype=np.int32), ws_sizes)
 
     return mapping_nodes_to_watersheds
 
 
-def merge_watersheds_flowing_into_each_other(watersheds, steepest_spill_pairs, rows, cols):
+def merge_watersheds_flowing_into_each_other(watersheds, steepest_spill_pairs, rows, cols, mapping=None):
 
-    map_node_to_ws = map_nodes_to_watersheds(watersheds, rows, cols)
+    if mapping is None:
+        mapping = map_nodes_to_watersheds(watersheds, rows, cols)
 
-    # Dictionary used for removing merged spill_pairs
-    d = {}
-    for s_p in steepest_spill_pairs:
-        key = (map_node_to_ws[s_p[0]], map_node_to_ws[s_p[1]])
-        value = s_p
-        d[key] = value
+    # Look up the watersheds of all spill pairs at once
+    spill_from, spill_to = split_spill_pairs(steepest_spill_pairs)
+    ws_from = mapping[spill_from]
+    ws_to = mapping[spill_to]
 
-    # Use set operations to find pairs of watersheds spilling to each other
-    temp = set([(map_node_to_ws[el[0]], map_node_to_ws[el[1]]) for el in steepest_spill_pairs])
-    temp_rev = set([(map_node_to_ws[el[1]], map_node_to_ws[el[0]]) for el in steepest_spill_pairs])
-    pairs_to_each_other = temp.intersection(temp_rev)
+    # Each watershed has at most one spill pair, so the watersheds spilling to each other are found by
+    # following the downslope watershed twice
+    downslope_ws = np.full(len(watersheds) + 1, -1, dtype=int)  # The last entry is for the boundary
+    downslope_ws[ws_from] = ws_to
+    to_each_other = (ws_to != -1) & (downslope_ws[ws_to] == ws_from)
 
-    # Remove (y, x) when (x, y) is in the set
-    merge_pairs = set(tuple(sorted(x)) for x in pairs_to_each_other)
+    # Keep (x, y) with x < y, in sorted order
+    is_first = to_each_other & (ws_from < ws_to)
+    merge_pairs = np.column_stack((ws_from[is_first], ws_to[is_first]))
+    merge_pairs = merge_pairs[np.lexsort((merge_pairs[:, 1], merge_pairs[:, 0]))]
 
     # Create the new list of watersheds
-    merged_watersheds = [np.concatenate((watersheds[el[0]], watersheds[el[1]])) for el in merge_pairs]
+    merged_watersheds = [np.concatenate((watersheds[x], watersheds[y])) for x, y in merge_pairs.tolist()]
 
-    merged_indices = np.unique(list(merge_pairs))
-    if len(pairs_to_each_other) > 0:
-        removed_spill_pairs = set(itemgetter(*pairs_to_each_other)(d))
-    else:
-        removed_spill_pairs = {}
+    merged_indices = np.unique(merge_pairs)
+    removed_spill_pairs = np.column_stack((spill_from[to_each_other], spill_to[to_each_other]))
 
     return merged_watersheds, removed_spill_pairs, merged_indices
 
 
+def remove_and_append_watersheds(watersheds, removed_indices, new_watersheds):
+    """
+    Remove the watersheds that have been merged, and add the merged ones to the end
+    :param watersheds: All watersheds
+    :param removed_indices: Indices of the watersheds that have been merged
+    :param new_watersheds: The merged watersheds
+    :return watersheds: The updated collection of watersheds
+    """
+
+    is_kept = np.ones(len(watersheds), dtype=bool)
+    is_kept[np.asarray(removed_indices, dtype=int)] = False
+    watersheds = [watersheds[i] for i in np.flatnonzero(is_kept)]
+    watersheds.extend(new_watersheds)
+
+    return watersheds
+
+
+def pack_spill_pairs(spill_pairs):
+    """
+    Pack each spill pair into one int64 key, so pairs can be compared with array operations
+    :param spill_pairs: Int array with one (from_node, to_node) row for each pair
+    :return keys: One key for each pair
+    """
+
+    keys = (spill_pairs[:, 0].astype(np.int64) << 32) | spill_pairs[:, 1].astype(np.int64)
+
+    return keys
+
+
+def remove_spill_pairs(spill_pairs, removed_spill_pairs):
+    """
+    Remove some spill pairs from an array of spill pairs
+    :param spill_pairs: Int array with one (from_node, to_node) row for each pair
+    :param removed_spill_pairs: The spill pairs to remove, in any from-to format
+    :return spill_pairs: The remaining spill pairs
+    """
+
+    removed = np.column_stack(split_spill_pairs(removed_spill_pairs))
+    keep = np.isin(pack_spill_pairs(spill_pairs), pack_spill_pairs(removed), invert=True)
+
+    return spill_pairs[keep]
+
+
+def update_nodes_to_watersheds(mapping, nr_of_watersheds, removed_indices, new_watersheds):
+    """
+    Update the map between node indices and watershed number to match remove_and_append_watersheds
+    :param mapping: Array where index gives watershed nr, -1 for nodes outside the watersheds
+    :param nr_of_watersheds: Nr of watersheds before the update
+    :param removed_indices: Indices of the watersheds that have been merged
+    :param new_watersheds: The merged watersheds
+    :return mapping: The updated map
+    """
+
+    is_kept = np.ones(nr_of_watersheds, dtype=bool)
+    is_kept[np.asarray(removed_indices, dtype=int)] = False
+    nr_of_kept = np.count_nonzero(is_kept)
+
+    # The kept watersheds move down to fill the gaps. The extra last entry keeps -1 as -1
+    new_index = -np.ones(nr_of_watersheds + 1, dtype=mapping.dtype)
+    new_index[:-1][is_kept] = np.arange(nr_of_kept)
+    mapping = new_index[mapping]
+
+    for i, watershed in enumerate(new_watersheds):
+        mapping[watershed] = nr_of_kept + i
+
+    return mapping
+
+
 def combine_watersheds_spilling_into_each_other(watersheds, heights, d4):
     """
     Iterative process to combine all watersheds spilling into each other
@@ -793,77 +1041,106 @@ def combine_watersheds_spilling_into_each_other(watersheds, heights, d4):
 
     ny, nx = np.shape(heights)
 
-    remaining_spill_pairs = {}
+    # The neighbors only depend on the node index, so they are computed once for all iterations
+    nbrs_all = get_neighbor_indices(np.arange(ny * nx), nx, d4)
+
+    # The watershed of each node is kept up to date as watersheds merge, instead of rebuilt in every step
+    mapping = map_nodes_to_watersheds(watersheds, ny, nx)
+
+    # The spill pairs are kept as rows of an int array, and compared through one packed key per pair
+    remaining_spill_pairs = np.empty((0, 2), dtype=int)
     merged_watersheds = watersheds
     steepest_spill_pairs = None
-    it = 0
 
     while len(merged_watersheds) > 0:
-        print it
-
         # Find spill pairs for given watersheds
-        boundary_pairs = get_boundary_pairs_for_specific_watersheds(merged_watersheds, nx, d4)
+        boundary_pairs = get_boundary_pairs_for_specific_watersheds(merged_watersheds, nx, d4, nbrs_all, mapping)
         spill_pairs = get_possible_spill_pairs(heights, boundary_pairs)
-        steepest_spill_pairs = get_steepest_spill_pair(heights, spill_pairs, d4)
+        steepest_spill_pairs = get_steepest_spill_pair_array(heights, spill_pairs, d4)
 
         # Add the new spill pairs to the unaltered ones
-        steepest_spill_pairs = steepest_spill_pairs.union(remaining_spill_pairs)
+        steepest_spill_pairs = np.concatenate((steepest_spill_pairs, remaining_spill_pairs))
+        first = np.unique(pack_spill_pairs(steepest_spill_pairs), return_index=True)[1]
+        steepest_spill_pairs = steepest_spill_pairs[np.sort(first)]
 
         # Merge watersheds spilling into each other
         merged_watersheds, removed_spill_pairs, merged_indices = merge_watersheds_flowing_into_each_other(
-            watersheds, steepest_spill_pairs, ny, nx)
-        remaining_spill_pairs = steepest_spill_pairs.difference(removed_spill_pairs)
+            watersheds, steepest_spill_pairs, ny, nx, mapping)
+        remaining_spill_pairs = remove_spill_pairs(steepest_spill_pairs, removed_spill_pairs)
 
         # Remove the merged watersheds from watersheds. Add the new ones to the end
-        watersheds = [watersheds[i] for i in range(len(watersheds)) if i not in merged_indices]
-        watersheds.extend(merged_watersheds)
+        mapping = update_nodes_to_watersheds(mapping, len(watersheds), merged_indices, merged_watersheds)
+        watersheds = remove_and_append_watersheds(watersheds, merged_indices, merged_watersheds)
 
-        it += 1
         if len(merged_watersheds) == 0:  # Remove cycles at last iteration
             merged_watersheds, removed_spill_pairs, merged_indices = remove_cycles(
-                watersheds, steepest_spill_pairs, ny, nx)
-            remaining_spill_pairs = steepest_spill_pairs.difference(removed_spill_pairs)
-            watersheds = [watersheds[i] for i in range(len(watersheds)) if i not in merged_indices]
-            watersheds.extend(merged_watersheds)
+                watersheds, steepest_spill_pairs, ny, nx, mapping)
+            remaining_spill_pairs = remove_spill_pairs(steepest_spill_pairs, removed_spill_pairs)
+            mapping = update_nodes_to_watersheds(mapping, len(watersheds), merged_indices, merged_watersheds)
+            watersheds = remove_and_append_watersheds(watersheds, merged_indices, merged_watersheds)
 
     # Order the steepest spill pairs
-    mapping = map_nodes_to_watersheds(watersheds, ny, nx)
-    if steepest_spill_pairs:
-        steepest_spill_pairs = list(steepest_spill_pairs)
-        order = np.argsort([mapping[s[0]] for s in steepest_spill_pairs])
-        steepest_spill_pairs = [steepest_spill_pairs[el] for el in order]
+    if steepest_spill_pairs is not None:
+        steepest_spill_pairs = steepest_spill_pairs[np.argsort(mapping[steepest_spill_pairs[:, 0]])]
+        steepest_spill_pairs = list(zip(steepest_spill_pairs[:, 0].tolist(), steepest_spill_pairs[:, 1].tolist()))
 
     return watersheds, steepest_spill_pairs
 
 
-def remove_cycles(watersheds, steepest, ny, nx):
-    # Remove cycles by combining the watersheds involved in a cycle
+def get_connected_watersheds(spill_pairs, nr_of_watersheds, connection):
+    """
+    Returns the groups of watersheds connected by spill pairs. Watersheds not connected to any other are left out.
+    :param spill_pairs: Pairs of watershed indices in from-to format
+    :param nr_of_watersheds: Total number of watersheds
+    :param connection: 'weak' or 'strong' connected components
+    :return groups: Array of watershed indices for each group, ordered by their smallest index
+    """
 
-    steepest = list(steepest)
-    mapping = map_nodes_to_watersheds(watersheds, ny, nx)
+    spill_pairs = np.asarray(spill_pairs, dtype=int).reshape(-1, 2)
+    data = np.ones(len(spill_pairs), dtype=np.int8)
+    conn_mat = csr_matrix((data, (spill_pairs[:, 0], spill_pairs[:, 1])), shape=(nr_of_watersheds, nr_of_watersheds))
+    n_components, labels = csgraph.connected_components(conn_mat, directed=True, connection=connection)
 
-    # Only spill_pairs going from a ws to another ws, no paths between ws and boundary
-    spill_pairs = [(mapping[steepest[i][0]], mapping[steepest[i][1]]) for i in range(len(steepest))
-                   if (mapping[steepest[i][0]] != -1 and mapping[steepest[i][1]] != -1)]
+    component_sizes = np.bincount(labels, minlength=n_components)
+    members = np.flatnonzero(component_sizes[labels] > 1)
+    if len(members) == 0:
+        return []
 
-    DG = networkx.DiGraph()
-    DG.add_edges_from(spill_pairs)
+    # A stable sort by label keeps the members ascending within each group
+    members = members[np.argsort(labels[members], kind='stable')]
+    group_sizes = component_sizes[component_sizes > 1]
+    groups = np.split(members, np.cumsum(group_sizes)[:-1])
+    groups.sort(key=lambda group: group[0])
 
-    # Remove cycles
-    cycles = sorted(networkx.simple_cycles(DG))
+    return groups
 
-    merged_indices = sorted([x for l in cycles for x in l])
-    ws_not_being_merged = np.setdiff1d(np.arange(0, len(watersheds), 1), merged_indices)
+
+def remove_cycles(watersheds, steepest, ny, nx, mapping=None):
+    # Remove cycles by combining the watersheds involved in a cycle
+
+    if mapping is None:
+        mapping = map_nodes_to_watersheds(watersheds, ny, nx)
+
+    # Only spill_pairs going from a ws to another ws, no paths between ws and boundary
+    spill_from, spill_to = split_spill_pairs(steepest)
+    ws_from = mapping[spill_from]
+    ws_to = mapping[spill_to]
+    between_watersheds = (ws_from != -1) & (ws_to != -1)
+    spill_pairs = np.column_stack((ws_from[between_watersheds], ws_to[between_watersheds]))
+
+    # Each watershed spills to at most one other, so the cycles are the strongly connected components
+    cycles = get_connected_watersheds(spill_pairs, len(watersheds), connection='strong')
+
+    # The cycles are disjoint, so the merged watersheds are found in order without sorting
+    is_merged = np.zeros(len(watersheds), dtype=bool)
+    if cycles:
+        is_merged[np.concatenate(cycles)] = True
+    merged_indices = np.flatnonzero(is_merged)
     merged_watersheds = [np.concatenate([watersheds[el] for el in c]) for c in cycles]
 
     # Remove the no longer valid spill pairs
-    d = {}
-    for s_p in steepest:
-        key = (mapping[s_p[0]], mapping[s_p[1]])
-        value = s_p
-        d[key] = value
-
-    removed_spill_pairs = set([d[el] for el in spill_pairs if el[0] in merged_indices])
+    removed = between_watersheds & is_merged[ws_from]
+    removed_spill_pairs = np.column_stack((spill_from[removed], spill_to[removed]))
 
     return merged_watersheds, removed_spill_pairs, merged_indices
 
@@ -877,15 +1154,17 @@ def get_spill_heights(watersheds, heights, steepest_spill_pairs):
     :return spill_heights: The spill height for each watershed
     """
 
-    if not steepest_spill_pairs:
+    if len(steepest_spill_pairs) == 0:
         return None
     r, c = np.shape(heights)
     mapping = map_nodes_to_watersheds(watersheds, r, c)
 
-    ws_pair_heights = [((mapping[el[0]], mapping[el[1]]), max(heights[map_1d_to_2d(el[0], c)], heights[map_1d_to_2d(el[1], c)]))
-                       for el in steepest_spill_pairs]
-    ws_pair_heights = sorted(ws_pair_heights)
-    spill_heights = np.asarray([el[1] for el in ws_pair_heights])
+    # The spill height of a pair is the highest of its two nodes. Order them by watershed
+    flat_heights = np.ravel(heights)
+    spill_from, spill_to = split_spill_pairs(steepest_spill_pairs)
+    pair_heights = np.maximum(flat_heights[spill_from], flat_heights[spill_to])
+    order = np.lexsort((pair_heights, mapping[spill_to], mapping[spill_from]))
+    spill_heights = pair_heights[order]
 
     return spill_heights
 
@@ -899,35 +1178,71 @@ def get_size_of_traps(watersheds, heights, spill_heights):
     :return size_of_traps: Number of elements below spill height for each watershed
     """
 
-    r, c = np.shape(heights)
-    size_of_traps = np.asarray([np.sum(heights[map_1d_to_2d(watersheds[i], c)] <= spill_heights[i])
-                                for i in range(len(spill_heights))])
+    flat_heights = np.ravel(heights)
+    all_ws_nodes, ws_sizes = get_all_watershed_nodes(watersheds)
+    is_in_trap = flat_heights[all_ws_nodes] <= np.repeat(spill_heights, ws_sizes)
+
+    # Count the trap nodes of each watershed in one pass
+    ws_nr_of_nodes = np.repeat(np.arange(len(watersheds)), ws_sizes)
+    size_of_traps = np.bincount(ws_nr_of_nodes[is_in_trap], minlength=len(watersheds))
 
     return size_of_traps
 
 
+def split_spill_pairs(steepest_spill_pairs):
+    """
+    Split the spill pairs into one array of spill from nodes and one of spill to nodes
+    :param steepest_spill_pairs: The steepest spill pair for each watershed
+    :return spill_from: The node in each watershed the spill goes from
+    :return spill_to: The node outside each watershed the spill goes to
+    """
+
+    if isinstance(steepest_spill_pairs, (set, frozenset)):
+        steepest_spill_pairs = list(steepest_spill_pairs)
+    spill_pairs = np.asarray(steepest_spill_pairs, dtype=int).reshape(-1, 2)
+    spill_from = np.ascontiguousarray(spill_pairs[:, 0])
+    spill_to = np.ascontiguousarray(spill_pairs[:, 1])
+
+    return spill_from, spill_to
+
+
 def remap_steepest_spill_pairs(watersheds, steepest_spill_pairs, rows, cols):
 
     mapping = map_nodes_to_watersheds(watersheds, rows, cols)
-    steepest_spill_pairs = [el for el in steepest_spill_pairs
-                            if np.logical_and(mapping[el[0]] != -1, mapping[el[0]] != mapping[el[1]])]
+
+    # Keep the pairs spilling from a watershed into another watershed or the boundary
+    steepest_spill_pairs = list(steepest_spill_pairs)
+    spill_from, spill_to = split_spill_pairs(steepest_spill_pairs)
+    ws_from = mapping[spill_from]
+    is_kept = (ws_from != -1) & (ws_from != mapping[spill_to])
+    steepest_spill_pairs = [steepest_spill_pairs[i] for i in np.flatnonzero(is_kept)]
 
     return steepest_spill_pairs
 
 
-def get_threshold_traps(watersheds, size_of_traps, threshold, heights):
+def get_threshold_traps(watersheds, size_of_traps, threshold, heights, spill_heights):
+    """
+    Get the traps of the watersheds with trap sizes above the threshold
+    :param watersheds: All watersheds in landscape
+    :param size_of_traps: Size of the trap in each watershed
+    :param threshold: Only traps with more nodes than this are kept
+    :param heights: Heights of landscape
+    :param spill_heights: Spill height in each watershed
+    :return traps: The traps above the threshold
+    """
 
-    r, c = np.shape(heights)
+    flat_heights = np.ravel(heights)
 
     keep_indices = np.where(size_of_traps > threshold)[0]
+    if len(keep_indices) == 0:
+        return []
 
-    # The traps of the watershed above the threshold
-    traps = []
-    for i in keep_indices:
-        ws = watersheds[i]
-        ws_2d = map_1d_to_2d(ws, c)
-        trap = ws[np.where(heights[ws_2d] <= size_of_traps[i])[0]]
-        traps.append(trap)
+    # The traps of the watershed above the threshold, found for all of them at once
+    all_ws_nodes, ws_sizes = get_all_watershed_nodes([watersheds[i] for i in keep_indices])
+    is_in_trap = flat_heights[all_ws_nodes] <= np.repeat(np.asarray(spill_heights)[keep_indices], ws_sizes)
+    ws_nr_of_nodes = np.repeat(np.arange(len(keep_indices)), ws_sizes)
+    trap_sizes = np.bincount(ws_nr_of_nodes[is_in_trap], minlength=len(keep_indices))
+    traps = np.split(all_ws_nodes[is_in_trap], np.cumsum(trap_sizes)[:-1])
 
     return traps
 
@@ -942,42 +1257,103 @@ def get_all_traps(watersheds, heights, spill_heights):
     :return size_of_traps: Size of each trap
     """
 
-    r, c = np.shape(heights)
+    if len(watersheds) == 0:
+        return [], np.asarray([], dtype=int)
 
-    traps = []
-    for i in range(len(watersheds)):
-        ws = watersheds[i]
-        ws_2d = map_1d_to_2d(ws, c)
-        trap = ws[np.where(heights[ws_2d] <= spill_heights[i])[0]]
-        traps.append(trap)
+    # Compare all watershed nodes with the spill height of their watershed at once
+    flat_heights = np.ravel(heights)
+    all_ws_nodes, ws_sizes = get_all_watershed_nodes(watersheds)
+    is_in_trap = flat_heights[all_ws_nodes] <= np.repeat(spill_heights, ws_sizes)
 
-    size_of_traps = np.asarray([len(t) for t in traps])
+    ws_nr_of_nodes = np.repeat(np.arange(len(watersheds)), ws_sizes)
+    size_of_traps = np.bincount(ws_nr_of_nodes[is_in_trap], minlength=len(watersheds))
+    traps = np.split(all_ws_nodes[is_in_trap], np.cumsum(size_of_traps)[:-1])
 
     return traps, size_of_traps
 
 
+def fill_depressions(watersheds, heights, spill_heights):
+    """
+    Fill the traps of all watersheds to their spill heights, without building the traps
+    :param watersheds: All watersheds in landscape
+    :param heights: Heights of landscape
+    :param spill_heights: Spill height in each watershed
+    :return: Nothing. It only modifies heights.
+    """
+
+    if len(watersheds) == 0:
+        return
+
+    # Same comparison as in get_all_traps, but the heights are written directly. The watersheds are disjoint,
+    # so they are filled in parallel
+    all_ws_nodes, ws_sizes = get_all_watershed_nodes(watersheds)
+    ws_ptr = np.concatenate(([0], np.cumsum(ws_sizes)))
+    flat_heights = np.ravel(heights)
+    _fill_traps(flat_heights, all_ws_nodes, ws_ptr, np.asarray(spill_heights, dtype=flat_heights.dtype))
+    if not np.shares_memory(flat_heights, heights):  # Non-contiguous heights are raveled to a copy
+        heights[...] = np.reshape(flat_heights, np.shape(heights))
+
+
+@njit(cache=True, parallel=True)
+def _fill_traps(flat_heights, all_ws_nodes, ws_ptr, spill_heights):
+    """
+    Raises all nodes below the spill height of their watershed to the spill height
+    :param flat_heights: Heights of landscape as a 1D-array
+    :param all_ws_nodes: All watershed nodes after each other
+    :param ws_ptr: Start of each watershed in all_ws_nodes
+    :param spill_heights: Spill height in each watershed
+    :return: Void function that alters flat_heights
+    """
+
+    for w in prange(len(ws_ptr) - 1):
+        for i in range(ws_ptr[w], ws_ptr[w + 1]):
+            node = all_ws_nodes[i]
+            if flat_heights[node] <= spill_heights[w]:
+                flat_heights[node] = spill_heights[w]
+
+
 def remove_watersheds_below_threshold(watersheds, conn_mat, size_of_traps, threshold_size):
+    """
+    Remove all watersheds with traps below the threshold. A removed watershed is merged with its downslope watershed,
+    and its upslope watersheds are rerouted to it. Watersheds without a downslope watershed are deleted.
+    :param watersheds: List of arrays where each array contains node indices for the watershed
+    :param conn_mat: Connectivity between watersheds, at most one downslope watershed for each watershed
+    :param size_of_traps: Size of the trap in each watershed
+    :param threshold_size: Watersheds with trap sizes below this are removed
+    :return conn_mat: The new connectivity matrix between the remaining watersheds
+    :return watersheds: The remaining watersheds
+    """
 
+    nr_of_watersheds = len(watersheds)
+    watersheds = list(watersheds)
     remove_indices = np.where(size_of_traps < threshold_size)[0]
-    it = 0
-
-    for i in range(len(remove_indices)):
-        remove_ix = remove_indices[i]
-        downslope_ws = conn_mat[remove_ix, :].nonzero()[1]  # Only one
-        upslope_ws = conn_mat[:, remove_ix].nonzero()[0]  # Might be several
-        a = watersheds[remove_ix]
-        if len(downslope_ws) == 0 and len(upslope_ws) == 0:  # Loner watershed
-            del watersheds[remove_ix]
-            remove_indices[remove_indices > remove_ix] -= 1
-            conn_mat = remove_ix_from_conn_mat(conn_mat, remove_ix)
-            it += 1
-        else:
-            if len(downslope_ws):  # Merge with downslope
-                watersheds[downslope_ws] = np.concatenate((watersheds[downslope_ws], watersheds[remove_ix]))
-            del watersheds[remove_ix]
-            remove_indices[remove_indices > remove_ix] -= 1
-            conn_mat = remove_ix_from_conn_mat(conn_mat, remove_ix)
-            it += 1
+
+    # Work on the downslope watershed of each watershed, and build the connectivity matrix once at the end
+    conn_mat = conn_mat.tocoo()
+    downslope = np.full(nr_of_watersheds, -1, dtype=int)
+    downslope[conn_mat.row] = conn_mat.col
+    upslope = defaultdict(list)
+    for up, down in zip(conn_mat.row.tolist(), conn_mat.col.tolist()):
+        upslope[down].append(up)
+
+    for remove_ix in remove_indices.tolist():
+        downslope_ws = downslope[remove_ix]
+        upslope_ws = upslope.pop(remove_ix, [])
+        if downslope_ws != -1:  # Merge with downslope, and reroute the upslope watersheds to it
+            watersheds[downslope_ws] = np.concatenate((watersheds[downslope_ws], watersheds[remove_ix]))
+            upslope[downslope_ws].extend(upslope_ws)
+        downslope[upslope_ws] = downslope_ws
+
+    keep = np.ones(nr_of_watersheds, dtype=bool)
+    keep[remove_indices] = False
+    new_index = np.cumsum(keep) - 1
+    is_connected = keep & (downslope != -1)
+    row_indices = new_index[is_connected]
+    col_indices = new_index[downslope[is_connected]]
+    nr_of_remaining = int(np.count_nonzero(keep))
+    conn_mat = csr_matrix((np.ones(len(row_indices), dtype=np.int8), (row_indices, col_indices)),
+                          shape=(nr_of_remaining, nr_of_remaining))
+    watersheds = [ws for ws, kept in zip(watersheds, keep.tolist()) if kept]
 
     return conn_mat, watersheds
 
@@ -1010,20 +1386,21 @@ def merge_watersheds(watersheds, steepest, nx, ny):
     mapping = map_nodes_to_watersheds(watersheds, ny, nx)
 
     # Only spill_pairs going from a ws to another ws, no paths between ws and boundary
-    spill_pairs = [(mapping[steepest[i][0]], mapping[steepest[i][1]]) for i in range(len(steepest))
-                   if (mapping[steepest[i][0]] != -1 and mapping[steepest[i][1]] != -1)]
-
-    DG = networkx.DiGraph()
-    DG.add_edges_from(spill_pairs)
-
-    G = DG.to_undirected()
-    watershed_indices = sorted(networkx.connected_components(G))
-
-    ws_being_merged = sorted([x for l in watershed_indices for x in l])
-    ws_not_being_merged = np.setdiff1d(np.arange(0, len(watersheds), 1), ws_being_merged)
+    spill_from, spill_to = split_spill_pairs(steepest)
+    ws_from = mapping[spill_from]
+    ws_to = mapping[spill_to]
+    between_watersheds = (ws_from != -1) & (ws_to != -1)
+    spill_pairs = np.column_stack((ws_from[between_watersheds], ws_to[between_watersheds]))
+
+    # All watersheds joined by spill pairs are merged at once, as the weakly connected components
+    watershed_indices = get_connected_watersheds(spill_pairs, len(watersheds), connection='weak')
+
+    is_merged = np.zeros(len(watersheds), dtype=bool)
+    if watershed_indices:
+        is_merged[np.concatenate(watershed_indices)] = True
     merged_watersheds = [np.concatenate([watersheds[el] for el in ws_set]) for ws_set in watershed_indices]
 
-    not_merged_watersheds = [watersheds[el] for el in ws_not_being_merged]
+    not_merged_watersheds = [ws for ws, merged in zip(watersheds, is_merged.tolist()) if not merged]
     merged_watersheds.extend(not_merged_watersheds)
 
     watersheds = merged_watersheds
@@ -1042,18 +1419,21 @@ def create_watershed_conn_matrix(watersheds, steepest_spill_pairs, rows, cols):
     """
 
     map_ix_to_ws = map_nodes_to_watersheds(watersheds, rows, cols)
-    steepest_pairs_ws_nr = [(map_ix_to_ws[p[0]], map_ix_to_ws[p[1]]) for p in steepest_spill_pairs
-                            if map_ix_to_ws[p[1]] != -1]
-    from_ws = [p[0] for p in steepest_pairs_ws_nr]
-    to_ws = [p[1] for p in steepest_pairs_ws_nr]
+    spill_from, spill_to = split_spill_pairs(steepest_spill_pairs)
+    from_ws = map_ix_to_ws[spill_from]
+    to_ws = map_ix_to_ws[spill_to]
+    is_to_watershed = to_ws != -1
 
     nr_of_watersheds = len(watersheds)
 
-    row_indices = from_ws
-    col_indices = to_ws
-    data = np.ones(len(row_indices))
+    # Remove duplicate connections through one key per pair. The sorted keys are in row order, so the csr-arrays
+    # are built directly
+    keys = np.unique(from_ws[is_to_watershed].astype(np.int64) * nr_of_watersheds + to_ws[is_to_watershed])
+    row_indices, col_indices = np.divmod(keys, nr_of_watersheds)
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(row_indices, minlength=nr_of_watersheds)))).astype(np.int32)
+    data = np.ones(len(keys), dtype=np.int8)
 
-    conn_mat = csr_matrix((data, (row_indices, col_indices)), shape=(nr_of_watersheds, nr_of_watersheds))
+    conn_mat = csr_matrix((data, col_indices.astype(np.int32), indptr), shape=(nr_of_watersheds, nr_of_watersheds))
 
     return conn_mat
 
@@ -1073,7 +1453,7 @@ def calculate_watersheds(heights, dim_x, dim_y, step_size, d4):
     flow_directions = get_flow_direction_indices(heights, step_size, dim_y, dim_x, d4)
     node_endpoints = get_node_endpoints(flow_directions)
     local_watersheds = get_local_watersheds(node_endpoints)
-    local_minima = np.asarray(local_watersheds.keys())
+    local_minima = np.fromiter(local_watersheds.keys(), dtype=int, count=len(local_watersheds))
     combined_minima = combine_minima(local_minima, dim_y, dim_x, d4)
     watersheds = combine_watersheds(local_watersheds, combined_minima)
     watersheds, steepest_spill_pairs = combine_watersheds_spilling_into_each_other(watersheds, heights, d4)
@@ -1110,10 +1490,7 @@ def make_landscape_depressionless(watersheds, steepest_spill_pairs, landscape):
     """
 
     spill_heights = get_spill_heights(watersheds, landscape.heights, steepest_spill_pairs)
-    traps, size_of_traps = get_all_traps(watersheds, landscape.heights, spill_heights)
-
-    for i in range(len(traps)):
-        landscape.heights[map_1d_to_2d(np.asarray(traps[i]), landscape.nx)] = spill_heights[i]
+    fill_depressions(watersheds, landscape.heights, spill_heights)
 
 
 def make_landscape_depressionless_no_landscape_input(watersheds, steepest_spill_pairs, heights, nx):
@@ -1128,10 +1505,7 @@ def make_landscape_depressionless_no_landscape_input(watersheds, steepest_spill_
     """
 
     spill_heights = get_spill_heights(watersheds, heights, steepest_spill_pairs)
-    traps, size_of_traps = get_all_traps(watersheds, heights, spill_heights)
-
-    for i in range(len(traps)):
-        heights[map_1d_to_2d(np.asarray(traps[i]), nx)] = spill_heights[i]
+    fill_depressions(watersheds, heights, spill_heights)
 
 
 def make_depressionless(heights, step_size, d4):
@@ -1148,20 +1522,55 @@ def make_depressionless(heights, step_size, d4):
     flow_directions = get_flow_direction_indices(heights, step_size, ny, nx, d4)
     node_endpoints = get_node_endpoints(flow_directions)
     local_watersheds = get_local_watersheds(node_endpoints)
-    local_minima = np.asarray(local_watersheds.keys())
+    local_minima = np.fromiter(local_watersheds.keys(), dtype=int, count=len(local_watersheds))
     combined_minima = combine_minima(local_minima, ny, nx, d4)
     watersheds = combine_watersheds(local_watersheds, combined_minima)
     watersheds, steepest_spill_pairs = combine_watersheds_spilling_into_each_other(watersheds, heights, d4)
 
     spill_heights = get_spill_heights(watersheds, heights, steepest_spill_pairs)
-    traps, size_of_traps = get_all_traps(watersheds, heights, spill_heights)
-
-    for i in range(len(traps)):
-        heights[map_1d_to_2d(np.asarray(traps[i]), nx)] = spill_heights[i]
+    fill_depressions(watersheds, heights, spill_heights)
 
     return heights
 
 
+@functools.lru_cache(maxsize=None)
+def get_flow_direction_offsets(cols):
+    """
+    Returns the index offset to each neighbor in increasing order, together with the flow direction of each offset.
+    The arrays are cached per number of columns and are read-only.
+    :param cols: Nr of columns in grid
+    :return offsets: The sorted offsets from a node to its 8 neighbors
+    :return directions: The flow direction of each offset
+    """
+
+    offsets = get_neighbor_indices(np.array([0]), cols, d4=False)[0]
+    directions = np.array([1, 2, 4, 8, 16, 32, 64, 128])
+    order = np.argsort(offsets)
+    offsets = offsets[order]
+    directions = directions[order]
+    offsets.setflags(write=False)
+    directions.setflags(write=False)
+
+    return offsets, directions
+
+
+def map_pairs_to_flow_direction(from_indices, to_indices, cols):
+    """
+    Map each pair of 1d-indices from_indices[i] -> to_indices[i] to the flow direction
+    :param from_indices: From indices
+    :param to_indices: To indices
+    :param cols: Nr of columns in grid
+    :return directions: The flow direction of each pair, -1 if the nodes are not neighbors
+    """
+
+    offsets, flow_directions = get_flow_direction_offsets(cols)
+    diff = np.asarray(to_indices) - np.asarray(from_indices)
+    position = np.minimum(np.searchsorted(offsets, diff), len(offsets) - 1)
+    directions = np.where(offsets[position] == diff, flow_directions[position], -1)
+
+    return directions
+
+
 def map_two_indices_to_flow_direction(ix_one, ix_two, cols):
     """
     Map two 1d-indices ix_one -> ix_two to the flow direction
@@ -1171,8 +1580,7 @@ def map_two_indices_to_flow_direction(ix_one, ix_two, cols):
     :return direction: One of the flow directions
     """
 
-    flow_directions = np.array([1, 2, 4, 8, 16, 32, 64, 128])
-    nbr_indices = get_neighbor_indices(np.array([ix_one]), cols, d4=False)
-    direction = flow_directions[np.where(nbr_indices == ix_two)[1]]
+    direction = map_pairs_to_flow_direction(np.array([ix_one]), np.array([ix_two]), cols)
+    direction = direction[direction != -1]
 
     return direction
@@ -346,3 +346,29 @@ def test_compare_two_lists_of_unsorted_arrays_five():
     are_equal = compare_methods.compare_two_lists_of_unsorted_arrays(l1, l2)
 
     assert are_equal is True
+
+
+def test_compare_rivers_in_trap_equally_short():
+    # Two different rivers of the same length through the trap
+
+    cols = 6
+    trap = np.array([8, 13, 14, 15, 20, 21, 22, 25, 26, 27, 32, 33, 34])
+    r1 = np.array([13, 14, 20, 26, 32, 33, 34])
+    r2 = np.array([13, 14, 15, 21, 27, 33, 34])
+
+    are_equal = compare_methods.compare_rivers_in_trap(r1, r2, trap, cols, d4=True)
+
+    assert are_equal is True
+
+
+def test_compare_rivers_in_trap_longer():
+    # The second river takes a detour
+
+    cols = 6
+    trap = np.array([8, 13, 14, 15, 20, 21, 22, 25, 26, 27, 32, 33, 34])
+    r1 = np.array([13, 20, 27, 34])
+    r2 = np.array([13, 14, 21, 27, 34])
+
+    are_equal = compare_methods.compare_rivers_in_trap(r1, r2, trap, cols, d4=False)
+
+    assert are_equal is False
@@ -95,11 +95,33 @@ def test_get_domain_boundary_coords_square():
 
     boundary = util.get_domain_boundary_coords(cols, rows)
 
-    print result_boundary
+    print(result_boundary)
 
     assert compare_methods.compare_coordinates(boundary, result_boundary)
 
 
+def test_map_1d_interior_to_2d_exterior():
+
+    cols = 4
+    indices = np.array([0, 5, 11])
+    result_row_col = np.array([[1, 1], [2, 2], [3, 4]])
+
+    row_col = util.map_1d_interior_to_2d_exterior(indices, cols)
+
+    assert np.array_equal(row_col, result_row_col)
+
+
+def test_map_2d_exterior_to_1d_interior():
+
+    cols = 4
+    coords = [(1, 1), (2, 2), (3, 4)]
+    result_indices = np.array([0, 5, 11])
+
+    indices = util.map_2d_exterior_to_1d_interior(coords, cols)
+
+    assert np.array_equal(indices, result_indices)
+
+
 def test_get_neighbor_heights():
 
     cols = 4
@@ -109,11 +131,10 @@ def test_get_neighbor_heights():
                         [9, 10, 11, 12],
                         [13, 14, 15, 16]])
 
-    neighbors = np.empty((rows, cols, 8), dtype=object)
-    neighbors[1, 1] = np.array([3, 7, 11, 10, 9, 5, 1, 2])
-    neighbors[1, 2] = np.array([4, 8, 12, 11, 10, 6, 2, 3])
-    neighbors[2, 1] = np.array([7, 11, 15, 14, 13, 9, 5, 6])
-    neighbors[2, 2] = np.array([8, 12, 16, 15, 14, 10, 6, 7])
+    neighbors = np.array([[[3, 7, 11, 10, 9, 5, 1, 2],
+                           [4, 8, 12, 11, 10, 6, 2, 3]],
+                          [[7, 11, 15, 14, 13, 9, 5, 6],
+                           [8, 12, 16, 15, 14, 10, 6, 7]]])
 
     result_neighbors = util.get_neighbor_heights(heights, rows, cols, d4=False)
 
@@ -129,11 +150,10 @@ def test_get_neighbor_heights_d4():
                         [9, 10, 11, 12],
                         [13, 14, 15, 16]])
 
-    neighbors = np.empty((rows, cols, 4), dtype=object)
-    neighbors[1, 1] = np.array([7, 10, 5, 2])
-    neighbors[1, 2] = np.array([8, 11, 6, 3])
-    neighbors[2, 1] = np.array([11, 14, 9, 6])
-    neighbors[2, 2] = np.array([12, 15, 10, 7])
+    neighbors = np.array([[[7, 10, 5, 2],
+                           [8, 11, 6, 3]],
+                          [[11, 14, 9, 6],
+                           [12, 15, 10, 7]]])
 
     result_neighbors = util.get_neighbor_heights(heights, rows, cols, d4=True)
 
@@ -148,9 +168,8 @@ def test_get_neighbor_heights_rect():
                         [1, 2, 3, 4],
                         [50, 40, 30, 20]])
 
-    neighbors = np.empty((rows, cols, 8), dtype=object)
-    neighbors[1, 1] = np.array([10, 3, 30, 40, 50, 1, 0, 5])
-    neighbors[1, 2] = np.array([15, 4, 20, 30, 40, 2, 5, 10])
+    neighbors = np.array([[[10, 3, 30, 40, 50, 1, 0, 5],
+                           [15, 4, 20, 30, 40, 2, 5, 10]]])
 
     result_neighbors = util.get_neighbor_heights(heights, rows, cols, d4=False)
 
@@ -165,9 +184,8 @@ def test_get_neighbor_heights_d4_rect():
                         [1, 2, 3, 4],
                         [50, 40, 30, 20]])
 
-    neighbors = np.empty((rows, cols, 4), dtype=object)
-    neighbors[1, 1] = np.array([3, 40, 1, 5])
-    neighbors[1, 2] = np.array([4, 30, 2, 10])
+    neighbors = np.array([[[3, 40, 1, 5],
+                           [4, 30, 2, 10]]])
 
     result_neighbors = util.get_neighbor_heights(heights, rows, cols, d4=True)
 
@@ -210,33 +228,34 @@ def test_get_derivatives():
                         [6, 77, 59, 75],
                         [68, 65, 7, 35],
                         [11, 31, 69, 20]])
-    nbr_heights = np.empty((r, c, 8), dtype=object)
-    nbr_heights[1, 1] = np.array([59, 59, 7, 65, 68, 6, 18, 63])
-    nbr_heights[1, 2] = np.array([3, 75, 35, 7, 65, 77, 63, 59])
-    nbr_heights[2, 1] = np.array([59, 7, 69, 31, 11, 68, 6, 77])
-    nbr_heights[2, 2] = np.array([75, 35, 20, 69, 31, 65, 77, 59])
+    nbr_heights = np.array([[[59, 59, 7, 65, 68, 6, 18, 63],
+                             [3, 75, 35, 7, 65, 77, 63, 59]],
+                            [[59, 7, 69, 31, 11, 68, 6, 77],
+                             [75, 35, 20, 69, 31, 65, 77, 59]]])
     h = 10.0
     d = math.sqrt(h ** 2 + h ** 2)
-
-    derivatives = np.array([[[None, None, None, None, None, None, None, None],
-                             [None, None, None, None, None, None, None, None],
-                             [None, None, None, None, None, None, None, None],
-                             [None, None, None, None, None, None, None, None]],
-                            [[None, None, None, None, None, None, None, None],
-                             [18/d, 18/h, 70/d, 12/h, 9/d, 71/h, 59/d, 14/h],
-                             [56/d, -16/h, 24/d, 52/h, -6/d, -18/h, -4/d, 0/h],
-                             [None, None, None, None, None, None, None, None]],
-                            [[None, None, None, None, None, None, None, None],
-                             [6/d, 58/h, -4/d, 34/h, 54/d, -3/h, 59/d, -12/h],
-                             [-68/d, -28/h, -13/d, -62/h, -24/d, -58/h, -70/d, -52/h],
-                             [None, None, None, None, None, None, None, None]],
-                            [[None, None, None, None, None, None, None, None],
-                             [None, None, None, None, None, None, None, None],
-                             [None, None, None, None, None, None, None, None],
-                             [None, None, None, None, None, None, None, None]]], dtype=object)
+    h_inv = 1 / h
+    d_inv = 1 / d
+
+    derivatives = np.array([[[np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan]],
+                            [[np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                             [18*d_inv, 18*h_inv, 70*d_inv, 12*h_inv, 9*d_inv, 71*h_inv, 59*d_inv, 14*h_inv],
+                             [56*d_inv, -16*h_inv, 24*d_inv, 52*h_inv, -6*d_inv, -18*h_inv, -4*d_inv, 0*h_inv],
+                             [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan]],
+                            [[np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                             [6*d_inv, 58*h_inv, -4*d_inv, 34*h_inv, 54*d_inv, -3*h_inv, 59*d_inv, -12*h_inv],
+                             [-68*d_inv, -28*h_inv, -13*d_inv, -62*h_inv, -24*d_inv, -58*h_inv, -70*d_inv, -52*h_inv],
+                             [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan]],
+                            [[np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan]]], dtype=float)
     result_derivatives = util.get_derivatives(heights, nbr_heights, h, d4=False)
 
-    assert np.array_equal(derivatives, result_derivatives)
+    assert np.array_equal(derivatives, result_derivatives, equal_nan=True)
 
 
 def test_get_derivatives_d4():
@@ -247,32 +266,32 @@ def test_get_derivatives_d4():
                         [6, 77, 59, 75],
                         [68, 65, 7, 35],
                         [11, 31, 69, 20]])
-    nbr_heights = np.empty((r, c, 4), dtype=object)
-    nbr_heights[1, 1] = np.array([59, 65, 6, 63])
-    nbr_heights[1, 2] = np.array([75, 7, 77, 59])
-    nbr_heights[2, 1] = np.array([7, 31, 68, 77])
-    nbr_heights[2, 2] = np.array([35, 69, 65, 59])
+    nbr_heights = np.array([[[59, 65, 6, 63],
+                             [75, 7, 77, 59]],
+                            [[7, 31, 68, 77],
+                             [35, 69, 65, 59]]])
     h = 10.0
-
-    derivatives = np.array([[[None, None, None, None],
-                             [None, None, None, None],
-                             [None, None, None, None],
-                             [None, None, None, None]],
-                            [[None, None, None, None],
-                             [18/h, 12/h, 71/h, 14/h],
-                             [-16/h, 52/h, -18/h, 0/h],
-                             [None, None, None, None]],
-                            [[None, None, None, None],
-                             [58/h, 34/h, -3/h, -12/h],
-                             [-28/h, -62/h, -58/h, -52/h],
-                             [None, None, None, None]],
-                            [[None, None, None, None],
-                             [None, None, None, None],
-                             [None, None, None, None],
-                             [None, None, None, None]]], dtype=object)
+    h_inv = 1 / h
+
+    derivatives = np.array([[[np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan]],
+                            [[np.nan, np.nan, np.nan, np.nan],
+                             [18*h_inv, 12*h_inv, 71*h_inv, 14*h_inv],
+                             [-16*h_inv, 52*h_inv, -18*h_inv, 0*h_inv],
+                             [np.nan, np.nan, np.nan, np.nan]],
+                            [[np.nan, np.nan, np.nan, np.nan],
+                             [58*h_inv, 34*h_inv, -3*h_inv, -12*h_inv],
+                             [-28*h_inv, -62*h_inv, -58*h_inv, -52*h_inv],
+                             [np.nan, np.nan, np.nan, np.nan]],
+                            [[np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan],
+                             [np.nan, np.nan, np.nan, np.nan]]], dtype=float)
     result_derivatives = util.get_derivatives(heights, nbr_heights, h, d4=True)
 
-    assert np.array_equal(derivatives, result_derivatives)
+    assert np.array_equal(derivatives, result_derivatives, equal_nan=True)
 
 
 def test_get_flow_directions():
@@ -285,10 +304,10 @@ def test_get_flow_directions():
                         [68, 65, 7, 35],
                         [11, 31, 69, 20]])
 
-    pos_flow_directions = np.array([[None, None, None, None],
-                                    [None, 32, 8, None],
-                                    [None, 2, -1, None],
-                                    [None, None, None, None]])
+    pos_flow_directions = np.array([[-1, -1, -1, -1],
+                                    [-1, 32, 8, -1],
+                                    [-1, 2, -1, -1],
+                                    [-1, -1, -1, -1]])
     result_pos_flow_directions = util.get_flow_directions(heights, step_size, rows, cols, d4=False)
 
     assert np.array_equal(pos_flow_directions, result_pos_flow_directions)
@@ -304,12 +323,12 @@ def test_get_flow_directions_d4():
                         [68, 65, 7, 35],
                         [11, 31, 69, 20]])
 
-    pos_flow_directions = np.array([[None, None, None, None],
-                                    [None, 3, 2, None],
-                                    [None, 1, -1, None],
-                                    [None, None, None, None]])
+    pos_flow_directions = np.array([[-1, -1, -1, -1],
+                                    [-1, 3, 2, -1],
+                                    [-1, 1, -1, -1],
+                                    [-1, -1, -1, -1]])
     result_pos_flow_directions = util.get_flow_directions(heights, step_size, rows, cols, d4=True)
-    print result_pos_flow_directions
+    print(result_pos_flow_directions)
 
     assert np.array_equal(pos_flow_directions, result_pos_flow_directions)
 
@@ -325,11 +344,11 @@ def test_get_flow_directions_advanced():
                         [7, 7, 3.9, 4, 0, 0],
                         [6, 5, 4, 4, 0, 0]])
 
-    flow_directions = np.array([[None, None, None, None, None, None],
-                                [None, -1, 32, 8, 1, None],
-                                [None, -1, 32, 4, 8, None],
-                                [None, 128, 64, 2, -1, None],
-                                [None, None, None, None, None, None]])
+    flow_directions = np.array([[-1, -1, -1, -1, -1, -1],
+                                [-1, -1, 32, 8, 1, -1],
+                                [-1, -1, 32, 4, 8, -1],
+                                [-1, 128, 64, 2, -1, -1],
+                                [-1, -1, -1, -1, -1, -1]])
     result_pos_flow_directions = util.get_flow_directions(heights, step_size, rows, cols, d4=False)
 
     assert np.array_equal(flow_directions, result_pos_flow_directions)
@@ -346,11 +365,11 @@ def test_get_flow_directions_d4_advanced():
                         [7, 7, 3.9, 4, 0, 0],
                         [6, 5, 4, 4, 0, 0]])
 
-    flow_directions = np.array([[None, None, None, None, None, None],
-                                [None, -1, 3, 2, 2, None],
-                                [None, -1, 3, 2, 2, None],
-                                [None, 4, -1, 1, -1, None],
-                                [None, None, None, None, None, None]])
+    flow_directions = np.array([[-1, -1, -1, -1, -1, -1],
+                                [-1, -1, 3, 2, 2, -1],
+                                [-1, -1, 3, 2, 2, -1],
+                                [-1, 4, -1, 1, -1, -1],
+                                [-1, -1, -1, -1, -1, -1]])
     result_pos_flow_directions = util.get_flow_directions(heights, step_size, rows, cols, d4=True)
 
     assert np.array_equal(flow_directions, result_pos_flow_directions)
@@ -366,10 +385,10 @@ def test_get_flow_directions_float():
                         [405.4, 402.0, 396.5, 389.5],
                         [407.9, 404.8, 398.4, 389.6]])
 
-    flow_directions = np.array([[None, None, None, None],
-                                [None, 1, 2, None],
-                                [None, 2, 2, None],
-                                [None, None, None, None]])
+    flow_directions = np.array([[-1, -1, -1, -1],
+                                [-1, 1, 2, -1],
+                                [-1, 2, 2, -1],
+                                [-1, -1, -1, -1]])
     result_pos_flow_directions = util.get_flow_directions(heights, step_size, rows, cols, d4=False)
 
     assert np.array_equal(flow_directions, result_pos_flow_directions)
@@ -385,10 +404,10 @@ def test_get_flow_directions_d4_float():
                         [405.4, 402.0, 396.5, 389.5],
                         [407.9, 404.8, 398.4, 389.6]])
 
-    flow_directions = np.array([[None, None, None, None],
-                                [None, 1, 1, None],
-                                [None, 1, 1, None],
-                                [None, None, None, None]])
+    flow_directions = np.array([[-1, -1, -1, -1],
+                                [-1, 1, 1, -1],
+                                [-1, 1, 1, -1],
+                                [-1, -1, -1, -1]])
     result_pos_flow_directions = util.get_flow_directions(heights, step_size, rows, cols, d4=True)
 
     assert np.array_equal(flow_directions, result_pos_flow_directions)
@@ -405,11 +424,11 @@ def test_get_flow_direction_indices_one():
                         [7, 7, 3.9, 4, 0, 0],
                         [6, 5, 4, 4, 0, 0]])
 
-    result_flow_direction_indices = np.array([[None, None, None, None, None, None],
-                                              [None, -1, 7, 15, -1, None],
-                                              [None, -1, 13, 22, 22, None],
-                                              [None, 13, 13, 22, -1, None],
-                                              [None, None, None, None, None, None]])
+    result_flow_direction_indices = np.array([[-1, -1, -1, -1, -1, -1],
+                                              [-1, -1, 7, 15, -1, -1],
+                                              [-1, -1, 13, 22, 22, -1],
+                                              [-1, 13, 13, 22, -1, -1],
+                                              [-1, -1, -1, -1, -1, -1]])
     flow_direction_indices = util.get_flow_direction_indices(heights, step_size, rows, cols, d4=False)
 
     assert np.array_equal(flow_direction_indices, result_flow_direction_indices)
@@ -426,11 +445,11 @@ def test_get_flow_direction_indices_d4_one():
                         [7, 7, 3.9, 4, 0, 0],
                         [6, 5, 4, 4, 0, 0]])
 
-    result_flow_direction_indices = np.array([[None, None, None, None, None, None],
-                                              [None, -1, 7, 15, 16, None],
-                                              [None, -1, 13, 21, 22, None],
-                                              [None, 13, -1, 22, -1, None],
-                                              [None, None, None, None, None, None]])
+    result_flow_direction_indices = np.array([[-1, -1, -1, -1, -1, -1],
+                                              [-1, -1, 7, 15, 16, -1],
+                                              [-1, -1, 13, 21, 22, -1],
+                                              [-1, 13, -1, 22, -1, -1],
+                                              [-1, -1, -1, -1, -1, -1]])
     flow_direction_indices = util.get_flow_direction_indices(heights, step_size, rows, cols, d4=True)
 
     assert np.array_equal(flow_direction_indices, result_flow_direction_indices)
@@ -447,11 +466,11 @@ def test_get_flow_direction_indices_d4_two():
                         [3, 3, 3, 2, 2],
                         [3, 3, 3, 2, 2]])
 
-    result_flow_direction_indices = np.array([[None, None, None, None, None],
-                                              [None, -1, 8, -1, None],
-                                              [None, 6, 13, -1, None],
-                                              [None, -1, 18, 13, None],
-                                              [None, None, None, None, None]])
+    result_flow_direction_indices = np.array([[-1, -1, -1, -1, -1],
+                                              [-1, -1, 8, -1, -1],
+                                              [-1, 6, 13, -1, -1],
+                                              [-1, -1, 18, 13, -1],
+                                              [-1, -1, -1, -1, -1]])
     flow_direction_indices = util.get_flow_direction_indices(heights, step_size, rows, cols, d4=True)
 
     assert np.array_equal(flow_direction_indices, result_flow_direction_indices)
@@ -459,11 +478,11 @@ def test_get_flow_direction_indices_d4_two():
 
 def test_make_sparse_node_conn_matrix():
 
-    flow_direction_indices = np.array([[None, None, None, None, None],
-                                       [None, 12, 12, 13, None],
-                                       [None, 12, 16, 18, None],
-                                       [None, -1, 16, -1, None],
-                                       [None, None, None, None, None]])
+    flow_direction_indices = np.array([[-1, -1, -1, -1, -1],
+                                       [-1, 12, 12, 13, -1],
+                                       [-1, 12, 16, 18, -1],
+                                       [-1, -1, 16, -1, -1],
+                                       [-1, -1, -1, -1, -1]])
     rows = 5
     cols = 5
 
@@ -478,6 +497,23 @@ def test_make_sparse_node_conn_matrix():
     assert np.array_equal(node_conn_mat.todense(), result_node_conn_mat.todense())
 
 
+def test_get_downslope_rivers():
+
+    row = np.array([0, 1, 2, 4])
+    col = np.array([1, 3, 3, 3])
+    data = np.ones(len(row), dtype=int)
+    adj_mat = csr_matrix((data, (row, col)), shape=(5, 5))
+
+    row = np.array([0, 0, 0, 1, 1, 2, 2, 3, 4, 4])
+    col = np.array([0, 1, 3, 1, 3, 2, 3, 3, 4, 3])
+    data = np.ones(len(row), dtype=int)
+    result_downslope_rivers = csr_matrix((data, (row, col)), shape=(5, 5))
+
+    downslope_rivers = util.get_downslope_rivers(adj_mat)
+
+    assert np.array_equal(downslope_rivers.todense(), result_downslope_rivers.todense())
+
+
 def test_remove_out_of_boundary_flow():
 
     flow_directions = np.array([[-2, -2, -2, -2, -2, -2],
@@ -541,17 +577,17 @@ def test_remove_out_of_boundary_flow_d4_advanced():
 
 def test_get_node_endpoints():
 
-    downslope_neighbors = np.array([[None, None, None, None, None, None],
-                                    [None, -1, 7, 15, -1, None],
-                                    [None, -1, 13, 22, 22, None],
-                                    [None, 13, 13, 22, -1, None],
-                                    [None, None, None, None, None, None]])
+    downslope_neighbors = np.array([[-1, -1, -1, -1, -1, -1],
+                                    [-1, -1, 7, 15, -1, -1],
+                                    [-1, -1, 13, 22, 22, -1],
+                                    [-1, 13, 13, 22, -1, -1],
+                                    [-1, -1, -1, -1, -1, -1]])
 
-    node_endpoints = np.array([[None, None, None, None, None, None],
-                               [None, 7, 7, 22, 10, None],
-                               [None, 13, 13, 22, 22, None],
-                               [None, 13, 13, 22, 22, None],
-                               [None, None, None, None, None, None]])
+    node_endpoints = np.array([[-1, -1, -1, -1, -1, -1],
+                               [-1, 7, 7, 22, 10, -1],
+                               [-1, 13, 13, 22, 22, -1],
+                               [-1, 13, 13, 22, 22, -1],
+                               [-1, -1, -1, -1, -1, -1]])
 
     result_node_endpoints = util.get_node_endpoints(downslope_neighbors)
 
@@ -560,11 +596,11 @@ def test_get_node_endpoints():
 
 def test_get_local_watersheds():
 
-    node_endpoints = np.array([[None, None, None, None, None, None],
-                               [None, 7, 7, 22, 10, None],
-                               [None, 13, 13, 22, 22, None],
-                               [None, 13, 13, 22, 22, None],
-                               [None, None, None, None, None, None]])
+    node_endpoints = np.array([[-1, -1, -1, -1, -1, -1],
+                               [-1, 7, 7, 22, 10, -1],
+                               [-1, 13, 13, 22, 22, -1],
+                               [-1, 13, 13, 22, 22, -1],
+                               [-1, -1, -1, -1, -1, -1]])
     result_local_watersheds = {7: np.array([7, 8]),
                                10: np.array([10]),
                                13: np.array([13, 14, 19, 20]),
@@ -574,14 +610,27 @@ def test_get_local_watersheds():
     assert compare_methods.compare_minima_watersheds(local_watersheds, result_local_watersheds)
 
 
+def test_get_local_watersheds_flow_to_boundary():
+
+    node_endpoints = np.array([[-1, -1, -1, -1, -1, -1],
+                               [-1, 7, 7, -3, -3, -1],
+                               [-1, 13, 13, -3, -3, -1],
+                               [-1, -1, -1, -1, -1, -1]])
+    result_local_watersheds = {7: np.array([7, 8]),
+                               13: np.array([13, 14])}
+    local_watersheds = util.get_local_watersheds(node_endpoints)
+
+    assert compare_methods.compare_minima_watersheds(local_watersheds, result_local_watersheds)
+
+
 def test_combine_watersheds():
 
     cols = 4
-    node_endpoints = np.array([[None, None, None, None, None, None],
-                               [None, 7, 7, 22, 10, None],
-                               [None, 13, 13, 22, 22, None],
-                               [None, 13, 13, 22, 22, None],
-                               [None, None, None, None, None, None]])
+    node_endpoints = np.array([[-1, -1, -1, -1, -1, -1],
+                               [-1, 7, 7, 22, 10, -1],
+                               [-1, 13, 13, 22, 22, -1],
+                               [-1, 13, 13, 22, 22, -1],
+                               [-1, -1, -1, -1, -1, -1]])
     combined_minima = [np.array([7, 13]),
                        np.array([10]),
                        np.array([22])]
@@ -598,6 +647,13 @@ def test_combine_watersheds():
     assert compare_methods.compare_watersheds(combined_watersheds, result_combined_watersheds)
 
 
+def test_combine_watersheds_no_minima():
+
+    result_combined_watersheds = util.combine_watersheds({}, [])
+
+    assert result_combined_watersheds == []
+
+
 def test_combine_minima_one_combination():
 
     rows = 4
@@ -784,7 +840,7 @@ def test_get_boundary_pairs_in_watersheds_d4():
                               np.array([22, 28, 23, 24, 32, 39, 45, 44, 35, 43])]]
 
     boundary_pairs = util.get_boundary_pairs_in_watersheds(watersheds, num_of_cols, num_of_rows, d4=True)
-    print boundary_pairs
+    print(boundary_pairs)
     are_equal = compare_methods.compare_list_of_lists_by_comparing_sets(boundary_pairs, result_boundary_pairs)
 
     assert are_equal
@@ -842,6 +898,24 @@ def test_get_boundary_pairs_for_specific_watersheds_d4():
     assert compare_methods.compare_list_of_lists_by_comparing_sets(boundary_pairs, result_boundary_pairs)
 
 
+def test_get_boundary_pairs_for_specific_watersheds_precomputed_nbrs():
+
+    nx = 10
+    ny = 10
+
+    merged_watersheds = [np.array([35, 33, 34]),
+                         np.array([63, 64, 65, 73, 74, 75, 83, 84, 85])]
+    nbrs_all = util.get_neighbor_indices(np.arange(nx * ny), nx, d4=False)
+
+    result_boundary_pairs = util.get_boundary_pairs_for_specific_watersheds(merged_watersheds, nx, d4=False)
+    boundary_pairs = util.get_boundary_pairs_for_specific_watersheds(merged_watersheds, nx, d4=False,
+                                                                      nbrs_all=nbrs_all)
+
+    for i in range(len(merged_watersheds)):
+        assert np.array_equal(boundary_pairs[i][0], result_boundary_pairs[i][0])
+        assert np.array_equal(boundary_pairs[i][1], result_boundary_pairs[i][1])
+
+
 def test_get_possible_spill_pairs():
 
     heights = np.array([[4, 10, 10, 10, 10, 10, 10],
@@ -957,6 +1031,42 @@ def test_remove_cycles_advanced():
     assert compare_methods.compare_watersheds(merged_watersheds, result_watersheds)
 
 
+def test_get_all_watershed_nodes():
+
+    watersheds = [np.array([7, 8, 13]), np.array([9]), np.array([19, 20, 21, 22])]
+    result_all_nodes = np.array([7, 8, 13, 9, 19, 20, 21, 22])
+    result_ws_sizes = np.array([3, 1, 4])
+
+    all_nodes, ws_sizes = util.get_all_watershed_nodes(watersheds)
+
+    assert np.array_equal(all_nodes, result_all_nodes) and np.array_equal(ws_sizes, result_ws_sizes)
+
+
+def test_remove_cycles_removed_spill_pairs():
+
+    rows = 6
+    cols = 8
+    watersheds = [np.array([9, 10, 17]),
+                  np.array([11, 12]),
+                  np.array([18, 19, 20, 28]),
+                  np.array([25, 26, 33, 34]),
+                  np.array([27, 35]),
+                  np.array([30, 38]),
+                  np.array([13, 14, 21, 22]),
+                  np.array([29, 36, 37])]
+    steepest_spill_pairs = [(10, 11), (12, 20), (18, 26), (25, 17),
+                            (27, 34), (22, 30), (38, 37), (29, 21)]
+
+    # Only the spill pair from [27, 35] is kept, as that watershed is not part of a cycle
+    result_removed_spill_pairs = {(10, 11), (12, 20), (18, 26), (25, 17), (22, 30), (38, 37), (29, 21)}
+    result_merged_indices = np.array([0, 1, 2, 3, 5, 6, 7])
+
+    merged_watersheds, removed_spill_pairs, merged_indices = util.remove_cycles(watersheds, steepest_spill_pairs, rows, cols)
+    removed_spill_pairs = set(map(tuple, np.asarray(removed_spill_pairs).tolist()))
+
+    assert removed_spill_pairs == result_removed_spill_pairs and np.array_equal(merged_indices, result_merged_indices)
+
+
 def test_map_nodes_to_watersheds():
 
     cols = 7
@@ -974,6 +1084,25 @@ def test_map_nodes_to_watersheds():
     assert np.array_equal(mapping_nodes_to_watersheds, result_mapping_nodes_to_watersheds)
 
 
+def test_update_nodes_to_watersheds():
+
+    cols = 7
+    rows = 7
+    watersheds = [np.array([8, 9, 15, 16, 22]),
+                  np.array([10, 11, 12, 17, 18, 19, 23, 24, 25, 26, 32, 33, 39, 40]),
+                  np.array([29, 30, 31, 36, 37, 38])]
+    merged_indices = np.array([0, 2])
+    merged_watersheds = [np.concatenate((watersheds[0], watersheds[2]))]
+
+    mapping = util.map_nodes_to_watersheds(watersheds, rows, cols)
+    mapping = util.update_nodes_to_watersheds(mapping, len(watersheds), merged_indices, merged_watersheds)
+
+    new_watersheds = util.remove_and_append_watersheds(watersheds, merged_indices, merged_watersheds)
+    result_mapping = util.map_nodes_to_watersheds(new_watersheds, rows, cols)
+
+    assert np.array_equal(mapping, result_mapping)
+
+
 def test_merge_watersheds_flowing_into_each_other():
 
     cols = 7
@@ -1106,6 +1235,49 @@ def test_get_all_traps():
            np.array_equal(size_of_traps, result_size_of_traps)
 
 
+def test_get_threshold_traps():
+
+    heights = np.array([[10, 10, 10, 10, 10, 10],
+                        [10, 9, 9, 9, 7, 10],
+                        [10, 9, 10, 9, 7, 10],
+                        [10, 10, 10, 10, 7, 10],
+                        [10, 4, 4, 4, 4.5, 10],
+                        [10, 4, 10, 10, 10, 10]])
+
+    watersheds = [np.array([7, 8, 13]), np.array([9, 10, 14, 15, 16]), np.array([19, 20, 21, 22, 25, 26, 27, 28])]
+    spill_heights = np.array([9, 7, 4])
+    size_of_traps = np.array([3, 2, 3])
+    threshold = 2
+    result_traps = [np.array([7, 8, 13]), np.array([25, 26, 27])]
+
+    traps = util.get_threshold_traps(watersheds, size_of_traps, threshold, heights, spill_heights)
+
+    assert compare_methods.compare_two_lists_of_arrays(traps, result_traps)
+
+
+def test_fill_depressions():
+
+    heights = np.array([[10, 10, 10, 10, 10, 10],
+                        [10, 9, 9, 9, 7, 10],
+                        [10, 9, 10, 9, 7, 10],
+                        [10, 10, 10, 10, 7, 10],
+                        [10, 4, 4, 4, 4.5, 10],
+                        [10, 4, 10, 10, 10, 10]])
+
+    watersheds = [np.array([7, 8, 13]), np.array([9, 10, 14, 15, 16]), np.array([19, 20, 21, 22, 25, 26, 27, 28])]
+    spill_heights = np.array([9, 7, 4.5])
+    result_heights = np.array([[10, 10, 10, 10, 10, 10],
+                               [10, 9, 9, 9, 7, 10],
+                               [10, 9, 10, 9, 7, 10],
+                               [10, 10, 10, 10, 7, 10],
+                               [10, 4.5, 4.5, 4.5, 4.5, 10],
+                               [10, 4, 10, 10, 10, 10]])
+
+    util.fill_depressions(watersheds, heights, spill_heights)
+
+    assert np.array_equal(heights, result_heights)
+
+
 def test_get_size_of_traps():
 
     heights = np.array([[4, 10, 10, 10, 10, 10, 10],
@@ -1125,6 +1297,32 @@ def test_get_size_of_traps():
     assert np.array_equal(size_of_traps, result_size_of_traps)
 
 
+def test_get_size_of_traps_empty_watersheds():
+
+    heights = np.array([[4, 10, 10],
+                        [10, 1, 8],
+                        [10, 6, 8]])
+    watersheds = [np.array([4, 5, 7]), np.array([], dtype=int), np.array([8])]
+    spill_heights = np.array([6, 5, 8])
+    result_size_of_traps = np.array([2, 0, 1])
+
+    size_of_traps = util.get_size_of_traps(watersheds, heights, spill_heights)
+    no_traps = util.get_size_of_traps([], heights, np.array([]))
+
+    assert np.array_equal(size_of_traps, result_size_of_traps) and len(no_traps) == 0
+
+
+def test_split_spill_pairs():
+
+    steepest_spill_pairs = [(8, 9), (16, 22), (26, -1)]
+    result_spill_from = np.array([8, 16, 26])
+    result_spill_to = np.array([9, 22, -1])
+
+    spill_from, spill_to = util.split_spill_pairs(steepest_spill_pairs)
+
+    assert np.array_equal(spill_from, result_spill_from) and np.array_equal(spill_to, result_spill_to)
+
+
 def test_remove_watersheds_below_threshold():
 
     #total_nodes = 60
@@ -1254,6 +1452,21 @@ def test_create_watershed_conn_matrix():
     assert np.array_equal(conn_mat.todense(), result_conn_mat.todense())
 
 
+def test_get_nonzero_rows_in_columns():
+
+    row = np.array([0, 1, 2, 3, 4, 5, 8])
+    col = np.array([3, 4, 4, 1, 8, 6, 7])
+    data = np.array([1, 1, 1, 1, 1, 1, 1])
+    conn_mat = csr_matrix((data, (row, col)), shape=(9, 9))
+    columns = np.array([4, 0, 8, 1])
+
+    result_rows, result_column_indices = conn_mat[:, columns].nonzero()
+
+    rows, column_indices = util.get_nonzero_rows_in_columns(conn_mat.tocsc(), columns)
+
+    assert set(zip(rows, column_indices)) == set(zip(result_rows, result_column_indices))
+
+
 def test_remove_ix_from_conn_mat_no_upslope():
 
     rows = np.array([0, 1, 2, 3, 4, 5, 7])
@@ -1558,3 +1771,15 @@ def test_map_two_indices_to_flow_direction_advanced_three():
     actual_sol = util.map_two_indices_to_flow_direction(ix_one, ix_two, cols)
 
     assert actual_sol == expected_sol
+
+
+def test_map_pairs_to_flow_direction():
+
+    cols = 6
+    from_indices = np.array([16, 16, 14, 14, 8])
+    to_indices = np.array([22, 21, 7, 15, 21])
+    expected_sol = np.array([8, 16, 64, 2, -1])
+
+    actual_sol = util.map_pairs_to_flow_direction(from_indices, to_indices, cols)
+
+    assert np.array_equal(actual_sol, expected_sol)